@@ -0,0 +1,192 @@
+"""
+Asyncio engine for running many compressions from one event loop
+
+Ghostscript is launched with asyncio.create_subprocess_exec and its output
+is streamed instead of buffered. All engines on one event loop share a
+semaphore sized to the host's cores and memory, which caps how many
+Ghostscript (or fallback) jobs run at once however many are queued.
+
+The cap is per event loop, so per process in the usual one-loop
+program. Several processes (e.g. batch_queue.py --processes N) each get
+their own cap; lower PDF_DOWNSIZING_MAX_GS accordingly.
+"""
+import io
+import os
+import asyncio
+import weakref
+import collections
+from typing import Iterable, List, Optional, Tuple
+
+from working_pdf_compressor import WorkingPDFCompressor, PDFSource, PDFTarget, StripPolicy, STRIP_PROFILES
+
+
+# Memory to reserve per concurrent Ghostscript process
+GS_MEMORY_BUDGET = 512 * 1024 * 1024
+
+# Overrides the computed process limit
+MAX_PROCESSES_ENV = "PDF_DOWNSIZING_MAX_GS"
+
+# Stderr lines kept for the result message
+STDERR_TAIL_LINES = 20
+
+# Bytes read from Ghostscript's stdout at a time
+STREAM_CHUNK_SIZE = 1 << 16
+
+
+def max_ghostscript_processes() -> int:
+    """How many Ghostscript processes this host can run at once"""
+    if os.environ.get(MAX_PROCESSES_ENV):
+        return max(1, int(os.environ[MAX_PROCESSES_ENV]))
+    
+    limit = os.cpu_count() or 1
+    try:
+        memory = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        limit = min(limit, memory // GS_MEMORY_BUDGET)
+    except (AttributeError, ValueError, OSError):
+        pass  # sysconf is not available on Windows
+    return max(1, limit)
+
+
+# Closed loops drop out on their own, so loops in other threads keep theirs
+_process_slots = weakref.WeakKeyDictionary()
+
+
+def process_slots() -> asyncio.Semaphore:
+    """The semaphore shared by every engine on the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop not in _process_slots:
+        _process_slots[loop] = asyncio.Semaphore(max_ghostscript_processes())
+    return _process_slots[loop]
+
+
+class AsyncPDFCompressor:
+    """Async counterpart of WorkingPDFCompressor"""
+    
+    def __init__(self, timeout: float = 60):
+        self.timeout = timeout
+        self.compressor = WorkingPDFCompressor()
+    
+    async def compress_pdf(self, input_path: str, output_path: str, quality: int = 80,
+                           strip: Optional[StripPolicy] = None, linearize: bool = False) -> Tuple[bool, str]:
+        """Compress a PDF file without blocking the event loop"""
+        if not 1 <= quality <= 100:
+            return False, "Quality must be between 1 and 100"
+        if isinstance(strip, str) and strip not in STRIP_PROFILES:
+            return False, f"Unknown strip profile: {strip}"
+        if not input_path or not os.path.exists(input_path):
+            return False, f"Input file does not exist: {input_path}"
+        
+        return await self._compress(input_path, output_path, quality, strip, linearize)
+    
+    async def compress_bytes(self, data: bytes, quality: int = 80, strip: Optional[StripPolicy] = None,
+                             linearize: bool = False) -> Tuple[bool, str, Optional[bytes]]:
+        """Compress an in-memory PDF; returns (success, message, compressed_data)"""
+        if not data:
+            return False, "Input data is empty", None
+        if not 1 <= quality <= 100:
+            return False, "Quality must be between 1 and 100", None
+        if isinstance(strip, str) and strip not in STRIP_PROFILES:
+            return False, f"Unknown strip profile: {strip}", None
+        
+        output = io.BytesIO()
+        success, message = await self._compress(bytes(data), output, quality, strip, linearize)
+        return success, message, output.getvalue() if success else None
+    
+    async def compress_many(self, jobs: Iterable[Tuple[str, str, int]]) -> List[Tuple[bool, str]]:
+        """Compress (input_path, output_path, quality) jobs concurrently, in order"""
+        return await asyncio.gather(*(self.compress_pdf(*job) for job in jobs))
+    
+    async def _compress(self, source: PDFSource, target: PDFTarget, quality: int,
+                        strip: Optional[StripPolicy] = None, linearize: bool = False) -> Tuple[bool, str]:
+        """Ghostscript first, then the PyMuPDF/PyPDF2 fallback in a worker thread"""
+        loop = asyncio.get_running_loop()
+        try:
+            gs_path = await loop.run_in_executor(None, self.compressor._get_ghostscript_path)
+            
+            async with process_slots():
+                success = False
+                if gs_path:
+                    success, message = await self._run_ghostscript(gs_path, source, target, quality)
+                    if success:
+                        success, message = self.compressor._ghostscript_result(
+                            source, target, self.compressor._source_size(source))
+                
+                if not success:
+                    success, message = await loop.run_in_executor(
+                        None, self.compressor._fallback_compression, source, target, quality)
+            
+            if success and strip:
+                message += await loop.run_in_executor(None, self.compressor._strip_target, target, strip)
+            if success and linearize:
+                message += await loop.run_in_executor(None, self.compressor._linearize_target,
+                                                      target, self.compressor._source_size(source))
+            if success and (strip or linearize):
+                message = self.compressor._final_message(message, source, target)
+            return success, message
+        
+        except Exception as e:
+            return False, f"Error compressing PDF: {str(e)}"
+    
+    async def _run_ghostscript(self, gs_path: str, source: PDFSource, target: PDFTarget,
+                               quality: int) -> Tuple[bool, str]:
+        """Run Ghostscript, streaming stdin/stdout for in-memory PDFs"""
+        # Choosing the calibrated tuning may open the PDF, so keep it off the loop
+        tuning = await asyncio.get_running_loop().run_in_executor(
+            None, self.compressor._ghostscript_tuning, gs_path, source)
+        cmd = self.compressor._ghostscript_command(gs_path, source, target, quality, tuning)
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if isinstance(source, bytes) else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL if isinstance(target, str) else asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        
+        stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        sink = None if isinstance(target, str) else self.compressor._open_target(target)
+        
+        async def feed_stdin():
+            if process.stdin is None:
+                return
+            try:
+                process.stdin.write(source)
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Ghostscript exited early; its stderr says why
+            finally:
+                process.stdin.close()
+        
+        async def pump_stdout():
+            if process.stdout is None:
+                return
+            while True:
+                chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    return
+                sink.write(chunk)
+        
+        async def read_stderr():
+            # Read in chunks; a line iterator fails on lines over 64 KiB
+            partial = b""
+            while True:
+                chunk = await process.stderr.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()[-STREAM_CHUNK_SIZE:]
+                stderr_tail.extend(line.decode(errors='replace').rstrip() for line in lines)
+            if partial:
+                stderr_tail.append(partial.decode(errors='replace').rstrip())
+        
+        pipes = asyncio.gather(feed_stdin(), pump_stdout(), read_stderr(), process.wait())
+        # Mark an error as seen when the pipes are abandoned on timeout or cancellation
+        pipes.add_done_callback(lambda future: future.cancelled() or future.exception())
+        try:
+            await asyncio.wait_for(pipes, self.timeout)
+        except asyncio.TimeoutError:
+            return False, f"Ghostscript timed out after {self.timeout:.0f} seconds"
+        finally:
+            # Also on cancellation or a read error, so no Ghostscript outlives its slot
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        
+        return process.returncode == 0, "\n".join(stderr_tail)
@@ -0,0 +1,257 @@
+"""
+Crash-safe, resumable batch compression with a journal manifest
+
+Every file's progress is appended to a JSON-lines journal that is flushed
+to disk after each record. Outputs are written to a temporary file and
+renamed into place, so a crash never leaves a half-written
+<name>_compressed.pdf behind. Rerunning with the same journal skips
+files that already finished and whose input has not changed since.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from working_pdf_compressor import WorkingPDFCompressor, STRIP_PROFILES
+
+
+class BatchJournal:
+    """Append-only record of per-file batch results"""
+    
+    def __init__(self, journal_path: str):
+        self.journal_path = os.path.abspath(journal_path)
+        self.entries = {}
+        self._load()
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+        if self._ends_mid_line():
+            self._file.write("\n")  # Keep new records off a torn line
+    
+    def _load(self):
+        """Read the journal; the last record for each input wins"""
+        if not os.path.exists(self.journal_path):
+            return
+        
+        with open(self.journal_path, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn final line from a crash
+                self.entries[entry["input_path"]] = entry
+    
+    def _ends_mid_line(self) -> bool:
+        """Whether the journal ends without a newline, e.g. after a crash"""
+        with open(self.journal_path, "rb") as journal_file:
+            journal_file.seek(0, os.SEEK_END)
+            if journal_file.tell() == 0:
+                return False
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) != b"\n"
+    
+    def record(self, entry: dict):
+        """Append a record and force it to disk"""
+        self.entries[entry["input_path"]] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def is_complete(self, input_path: str, input_stat: os.stat_result, settings: dict) -> bool:
+        """
+        Whether an input finished in an earlier run with the same settings
+        (output path, quality and so on) and is unchanged since
+        
+        Only stat calls are made, so resuming a large batch does not
+        re-read any PDF.
+        """
+        entry = self.entries.get(input_path)
+        if not entry or entry["status"] != "done":
+            return False
+        
+        if (entry["input_size"] != input_stat.st_size or
+                entry["input_mtime_ns"] != input_stat.st_mtime_ns):
+            return False
+        
+        if any(entry.get(name) != value for name, value in settings.items()):
+            return False
+        
+        try:
+            return os.path.getsize(entry["output_path"]) == entry["output_size"]
+        except OSError:
+            return False
+    
+    def close(self):
+        self._file.close()
+
+
+def find_pdfs(paths: List[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Expand files and directories into absolute PDF paths
+    
+    Each path comes with its name relative to the directory it was found
+    in, or its base name if it was given as a file.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(".pdf") and not name.lower().endswith("_compressed.pdf"):
+                        input_path = os.path.abspath(os.path.join(directory, name))
+                        yield input_path, os.path.relpath(input_path, os.path.abspath(path))
+        else:
+            yield os.path.abspath(path), os.path.basename(path)
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def output_path_for(input_path: str, output_dir: Optional[str] = None,
+                    relative_path: Optional[str] = None, claimed: Optional[Dict[str, str]] = None) -> str:
+    """
+    Where the compressed copy of an input goes
+    
+    Under output_dir the input's relative path is mirrored, so inputs with
+    the same name in different subdirectories do not meet. An output
+    already claimed by another input gets a suffix from a hash of the
+    input path instead of overwriting it.
+    """
+    if output_dir:
+        name = relative_path or os.path.basename(input_path)
+        stem = os.path.join(os.path.abspath(output_dir), os.path.splitext(name)[0])
+    else:
+        stem = os.path.splitext(input_path)[0]
+    output_path = f"{stem}_compressed.pdf"
+    
+    if claimed is not None and claimed.get(output_path, input_path) != input_path:
+        suffix = hashlib.sha1(input_path.encode("utf-8")).hexdigest()[:8]
+        output_path = f"{stem}_{suffix}_compressed.pdf"
+    return output_path
+
+
+def fsync_directory(directory: str):
+    """Force a rename in a directory to disk; Windows has no directory handles to flush"""
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def compress_atomically(compressor: WorkingPDFCompressor, input_path: str, output_path: str,
+                        quality: int, target_ssim: Optional[float] = None, strip: Optional[str] = None,
+                        linearize: bool = False):
+    """Compress into a temporary file and rename it over the output only on success"""
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        success, message = compressor.compress_pdf(input_path, temp_path, quality, target_ssim,
+                                                   strip, linearize)
+        if success:
+            # Windows can only flush a file opened for writing
+            with open(temp_path, "r+b") as temp_file:
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, output_path)
+            fsync_directory(os.path.dirname(output_path))
+        return success, message
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def run_batch(input_paths: List[str], journal_path: str, quality: int = 80,
+              output_dir: Optional[str] = None, target_ssim: Optional[float] = None,
+              strip: Optional[str] = None, linearize: bool = False) -> Dict[str, int]:
+    """
+    Compress many PDFs, resuming from the journal if it already exists
+    
+    Returns counts of files compressed, skipped and failed.
+    """
+    journal = BatchJournal(journal_path)
+    compressor = WorkingPDFCompressor()
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    claimed = {}
+    
+    try:
+        for input_path, relative_path in find_pdfs(input_paths):
+            try:
+                input_stat = os.stat(input_path)
+            except OSError as e:
+                journal.record({"input_path": input_path, "status": "failed",
+                                "message": f"Error reading file: {str(e)}"})
+                counts["failed"] += 1
+                continue
+            
+            output_path = output_path_for(input_path, output_dir, relative_path, claimed)
+            claimed[output_path] = input_path
+            settings = {
+                "output_path": output_path,
+                "quality": quality,
+                "target_ssim": target_ssim,
+                "strip": strip,
+                "linearize": linearize,
+            }
+            if journal.is_complete(input_path, input_stat, settings):
+                counts["skipped"] += 1
+                continue
+            
+            entry = dict(settings, input_path=input_path,
+                         input_size=input_stat.st_size,
+                         input_mtime_ns=input_stat.st_mtime_ns)
+            journal.record(dict(entry, status="started", started_at=time.time()))
+            
+            started = time.perf_counter()
+            try:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                success, message = compress_atomically(compressor, input_path, output_path,
+                                                       quality, target_ssim, strip, linearize)
+            except Exception as e:
+                success, message = False, f"Error compressing PDF: {str(e)}"
+            entry["seconds"] = round(time.perf_counter() - started, 3)
+            entry["message"] = message
+            
+            if success:
+                entry.update(status="done",
+                             input_sha256=file_sha256(input_path),
+                             output_size=os.path.getsize(output_path),
+                             output_sha256=file_sha256(output_path))
+                counts["done"] += 1
+            else:
+                entry["status"] = "failed"
+                counts["failed"] += 1
+            journal.record(entry)
+    finally:
+        journal.close()
+    
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable batch PDF compression")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories")
+    parser.add_argument("--journal", default="batch_journal.jsonl",
+                        help="journal file; rerun with the same journal to resume")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--target-ssim", type=float)
+    parser.add_argument("--output-dir")
+    parser.add_argument("--strip", choices=sorted(STRIP_PROFILES),
+                        help="remove thumbnails, private data etc. and subset fonts after compressing")
+    parser.add_argument("--linearize", action="store_true", help="write outputs for fast web view")
+    args = parser.parse_args()
+    
+    counts = run_batch(args.paths, args.journal, args.quality, args.output_dir, args.target_ssim,
+                       args.strip, args.linearize)
+    print(f"Compressed: {counts['done']}, skipped: {counts['skipped']}, failed: {counts['failed']}")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+Shared-directory work queue for batch compression across several machines
+
+Layout of a queue directory (must be on storage every worker can reach):
+
+    jobs/<job_id>.json       one file to compress, written by the coordinator
+    leases/<job_id>.lease    held by the worker compressing that job
+    results/<job_id>.json    outcome of a finished job
+    workers/<worker_id>      heartbeat file used to read the shared clock
+    manifest.json            summary of all results, written by the coordinator
+
+Leases are created atomically (O_CREAT | O_EXCL) and kept alive by touching
+them. A lease that has not been touched for the lease timeout belongs to a
+crashed worker and is reclaimed by the next worker that finds it.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from typing import Dict, List, Optional, Tuple
+
+from batch_journal import output_path_for
+from working_pdf_compressor import WorkingPDFCompressor
+
+
+# Seconds without a heartbeat before a lease is considered abandoned
+LEASE_TIMEOUT = 120.0
+
+# Seconds an idle worker waits before looking for work again
+POLL_INTERVAL = 2.0
+
+
+class BatchQueue:
+    """Coordinator and worker operations on a shared queue directory"""
+    
+    def __init__(self, queue_dir: str, lease_timeout: float = LEASE_TIMEOUT):
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.lease_timeout = lease_timeout
+        self.jobs_dir = os.path.join(self.queue_dir, "jobs")
+        self.leases_dir = os.path.join(self.queue_dir, "leases")
+        self.results_dir = os.path.join(self.queue_dir, "results")
+        self.workers_dir = os.path.join(self.queue_dir, "workers")
+        for directory in (self.jobs_dir, self.leases_dir, self.results_dir, self.workers_dir):
+            os.makedirs(directory, exist_ok=True)
+    
+    # Coordinator
+    
+    def submit(self, input_paths: List[str], quality: int = 80,
+               output_dir: Optional[str] = None) -> int:
+        """
+        Queue PDF files for compression, returning how many were queued
+        
+        Files already queued are skipped unless their job failed, in which
+        case the job is queued again. Outputs are named as in batch_journal,
+        so no two jobs write the same file.
+        """
+        submitted = 0
+        claimed = {}
+        for job_id in self._job_ids():
+            job = self._read_json(os.path.join(self.jobs_dir, f"{job_id}.json"))
+            if job:
+                claimed[job["output_path"]] = job["input_path"]
+        
+        for input_path in input_paths:
+            input_path = os.path.abspath(input_path)
+            job_id = hashlib.sha1(input_path.encode("utf-8")).hexdigest()[:16]
+            job_path = os.path.join(self.jobs_dir, f"{job_id}.json")
+            if os.path.exists(job_path):
+                submitted += self.requeue_failed([job_id])
+                continue
+            
+            job = {
+                "job_id": job_id,
+                "input_path": input_path,
+                "output_path": output_path_for(input_path, output_dir, claimed=claimed),
+                "quality": quality,
+            }
+            claimed[job["output_path"]] = input_path
+            self._write_json(job_path, job)
+            submitted += 1
+        
+        return submitted
+    
+    def status(self) -> Dict[str, int]:
+        """Count jobs by state"""
+        counts = {"total": 0, "done": 0, "failed": 0, "running": 0, "pending": 0}
+        now = self._shared_now()
+        for job_id in self._job_ids():
+            counts["total"] += 1
+            result = self._read_json(self._result_path(job_id))
+            if result:
+                counts["done" if result["success"] else "failed"] += 1
+            elif self._lease_is_live(job_id, now):
+                counts["running"] += 1
+            else:
+                counts["pending"] += 1
+        return counts
+    
+    def requeue_failed(self, job_ids: Optional[List[str]] = None) -> int:
+        """Drop the results of failed jobs so workers pick them up again"""
+        requeued = 0
+        for job_id in job_ids if job_ids is not None else self._job_ids():
+            result = self._read_json(self._result_path(job_id))
+            if result and not result["success"]:
+                self._remove(self._result_path(job_id))
+                requeued += 1
+        return requeued
+    
+    def write_manifest(self) -> dict:
+        """Collect all results into manifest.json and return it"""
+        manifest = {"queue_dir": self.queue_dir, "status": self.status(), "results": []}
+        for job_id in self._job_ids():
+            result = self._read_json(self._result_path(job_id))
+            if result:
+                manifest["results"].append(result)
+        
+        self._write_json(os.path.join(self.queue_dir, "manifest.json"), manifest)
+        return manifest
+    
+    # Worker
+    
+    def run_worker(self, worker_id: Optional[str] = None, poll_interval: float = POLL_INTERVAL,
+                   exit_when_done: bool = True) -> int:
+        """
+        Claim and compress jobs until none are left, returning how many were done
+        
+        A worker with nothing to claim keeps polling while other workers hold
+        leases, so that it can take over their jobs if they crash.
+        """
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        compressor = WorkingPDFCompressor()
+        processed = 0
+        
+        while True:
+            claimed_any = False
+            unfinished = 0
+            
+            for job_id in self._job_ids():
+                if os.path.exists(self._result_path(job_id)):
+                    continue
+                unfinished += 1
+                
+                token = self._claim(job_id, worker_id)
+                if token is None:
+                    continue
+                
+                claimed_any = True
+                if self._process(compressor, job_id, worker_id, token):
+                    processed += 1
+            
+            if unfinished == 0 and exit_when_done:
+                return processed
+            if not claimed_any:
+                time.sleep(poll_interval)
+    
+    def _process(self, compressor: WorkingPDFCompressor, job_id: str,
+                 worker_id: str, token: str) -> bool:
+        """Compress one claimed job while heartbeating its lease"""
+        job = self._read_json(os.path.join(self.jobs_dir, f"{job_id}.json"))
+        lease_path = self._lease_path(job_id)
+        
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, token, stop))
+        heartbeat.daemon = True
+        heartbeat.start()
+        
+        started = time.time()
+        output_path = job["output_path"]
+        temp_path = f"{output_path}.{worker_id}.tmp"
+        try:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            success, message = compressor.compress_pdf(job["input_path"], temp_path, job["quality"])
+        except Exception as e:
+            success, message = False, f"Error compressing PDF: {str(e)}"
+        finally:
+            stop.set()
+            heartbeat.join()
+        
+        # A worker that stalled past its lease may have lost the job to another
+        if self._lease_token(job_id) != token:
+            self._remove(temp_path)
+            return False
+        
+        result = {
+            "job_id": job_id,
+            "input_path": job["input_path"],
+            "output_path": output_path,
+            "success": success,
+            "message": message,
+            "worker": worker_id,
+            "seconds": round(time.time() - started, 3),
+            "original_size": os.path.getsize(job["input_path"]) if os.path.exists(job["input_path"]) else None,
+            "compressed_size": None,
+        }
+        if success and os.path.exists(temp_path):
+            os.replace(temp_path, output_path)
+            result["compressed_size"] = os.path.getsize(output_path)
+        else:
+            self._remove(temp_path)
+        
+        self._write_json(self._result_path(job_id), result)
+        self._remove(lease_path)
+        return success
+    
+    def _claim(self, job_id: str, worker_id: str) -> Optional[str]:
+        """Atomically take the lease on a job, reclaiming it if abandoned"""
+        lease_path = self._lease_path(job_id)
+        token = uuid.uuid4().hex
+        
+        if os.path.exists(lease_path):
+            now = self._shared_now()
+            if self._lease_is_live(job_id, now):
+                return None
+            
+            # Move the abandoned lease aside; only one worker can win the rename
+            tombstone = f"{lease_path}.{token}.expired"
+            try:
+                os.rename(lease_path, tombstone)
+            except OSError:
+                return None
+            
+            # Another worker may have renewed it between our check and the rename
+            if now - os.path.getmtime(tombstone) < self.lease_timeout:
+                try:
+                    os.link(tombstone, lease_path)
+                except OSError:
+                    pass
+                self._remove(tombstone)
+                return None
+            self._remove(tombstone)
+        
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        
+        with os.fdopen(fd, "w") as lease_file:
+            json.dump({"worker": worker_id, "token": token, "claimed_at": time.time()}, lease_file)
+        
+        # The job may have finished while we were claiming it
+        if os.path.exists(self._result_path(job_id)):
+            self._remove(lease_path)
+            return None
+        return token
+    
+    def _heartbeat(self, job_id: str, token: str, stop: threading.Event):
+        """
+        Touch a lease until told to stop or until another worker holds it
+        
+        A missing lease is not taken as lost: another worker's reclaim check
+        briefly renames a live lease away before linking it back.
+        """
+        while not stop.wait(self.lease_timeout / 4):
+            current = self._lease_token(job_id)
+            if current is not None and current != token:
+                return  # Lease was reclaimed by another worker
+            try:
+                os.utime(self._lease_path(job_id), None)
+            except OSError:
+                pass
+    
+    def _lease_is_live(self, job_id: str, now: float) -> bool:
+        """Whether a job's lease exists and was touched recently"""
+        try:
+            return now - os.path.getmtime(self._lease_path(job_id)) < self.lease_timeout
+        except OSError:
+            return False
+    
+    def _lease_token(self, job_id: str) -> Optional[str]:
+        """Token of the worker currently holding a job's lease"""
+        lease = self._read_json(self._lease_path(job_id))
+        return lease.get("token") if lease else None
+    
+    def _shared_now(self) -> float:
+        """
+        Current time on the shared storage
+        
+        Lease ages are measured against a file we touch ourselves, so clock
+        skew between hosts does not expire live leases early.
+        """
+        probe = os.path.join(self.workers_dir, f"{socket.gethostname()}-{os.getpid()}")
+        with open(probe, "a"):
+            pass
+        os.utime(probe, None)
+        return os.path.getmtime(probe)
+    
+    # Files
+    
+    def _job_ids(self) -> List[str]:
+        """All submitted job ids in a stable order"""
+        return sorted(name[:-5] for name in os.listdir(self.jobs_dir) if name.endswith(".json"))
+    
+    def _lease_path(self, job_id: str) -> str:
+        return os.path.join(self.leases_dir, f"{job_id}.lease")
+    
+    def _result_path(self, job_id: str) -> str:
+        return os.path.join(self.results_dir, f"{job_id}.json")
+    
+    def _write_json(self, path: str, data: dict):
+        """Write JSON atomically so readers never see a partial file"""
+        temp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as json_file:
+            json.dump(data, json_file, indent=2, ensure_ascii=False)
+        os.replace(temp_path, path)
+    
+    def _read_json(self, path: str) -> Optional[dict]:
+        try:
+            with open(path, "r", encoding="utf-8") as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return None
+    
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _worker_process(queue_dir: str, lease_timeout: float, poll_interval: float):
+    """Entry point for local worker processes"""
+    BatchQueue(queue_dir, lease_timeout).run_worker(poll_interval=poll_interval)
+
+
+def run_local_workers(queue_dir: str, workers: int, lease_timeout: float = LEASE_TIMEOUT,
+                      poll_interval: float = POLL_INTERVAL) -> Tuple[int, ...]:
+    """Run several worker processes on this machine and wait for them"""
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(queue_dir, lease_timeout, poll_interval))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return tuple(process.exitcode for process in processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch PDF compression over a shared directory")
+    parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT,
+                        help="seconds without heartbeat before a job is reclaimed")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    submit = commands.add_parser("submit", help="queue PDF files")
+    submit.add_argument("queue_dir")
+    submit.add_argument("files", nargs="+")
+    submit.add_argument("--quality", type=int, default=80)
+    submit.add_argument("--output-dir")
+    
+    worker = commands.add_parser("worker", help="process jobs until the queue is empty")
+    worker.add_argument("queue_dir")
+    worker.add_argument("--worker-id")
+    worker.add_argument("--processes", type=int, default=1,
+                        help="worker processes to run on this machine")
+    
+    retry = commands.add_parser("retry", help="queue failed jobs again")
+    retry.add_argument("queue_dir")
+    
+    status = commands.add_parser("status", help="show progress and write manifest.json")
+    status.add_argument("queue_dir")
+    
+    args = parser.parse_args()
+    queue = BatchQueue(args.queue_dir, args.lease_timeout)
+    
+    if args.command == "submit":
+        print(f"Queued {queue.submit(args.files, args.quality, args.output_dir)} files")
+    elif args.command == "retry":
+        print(f"Requeued {queue.requeue_failed()} failed jobs")
+    elif args.command == "worker":
+        if args.processes > 1:
+            run_local_workers(args.queue_dir, args.processes, args.lease_timeout, args.poll_interval)
+        else:
+            processed = queue.run_worker(args.worker_id, args.poll_interval)
+            print(f"Worker finished: {processed} files compressed")
+    
+    manifest = queue.write_manifest()
+    print(", ".join(f"{name}: {count}" for name, count in manifest["status"].items()))
+    return 1 if manifest["status"]["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
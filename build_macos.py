@@ -17,6 +17,7 @@ def build_macos_executable():
         "pyinstaller",
         "--onedir",
         "--windowed",
+        "--noupx",  # UPX-packed binaries are unpacked again on every launch
         "--name=PDF-DownSizing-Tool",
         "--icon=icon.icns" if os.path.exists("icon.icns") else "",
         "--add-data=README.md:.",
@@ -17,6 +17,7 @@ def build_windows_executable():
         "pyinstaller",
         "--onefile",
         "--windowed",
+        "--noupx",  # UPX-packed binaries are unpacked again on every launch
         "--name=PDF-DownSizing-Tool",
         "--icon=icon.ico" if os.path.exists("icon.ico") else "",
         "--add-data=README.md:." if os.path.exists("README.md") else "",
@@ -0,0 +1,219 @@
+"""
+Calibrate Ghostscript performance parameters on this machine
+
+Runs a sample set of PDFs through the same Ghostscript command the
+compressor uses, once for every combination in PARAMETER_GRID, and saves
+the fastest combination per document class (image, text, mixed) to the
+profile that WorkingPDFCompressor loads automatically.
+
+These parameters mainly tune Ghostscript's rendering and banding, and
+pdfwrite rarely rasterizes, so on most hosts the differences are
+within run-to-run noise. A combination is only saved when it beats the
+defaults by more than the spread between repeated runs; otherwise the
+class keeps Ghostscript's defaults.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import statistics
+import subprocess
+import tempfile
+from typing import Dict, List, Optional
+
+from working_pdf_compressor import WorkingPDFCompressor, GS_PROFILE_ENV, GS_PROFILE_PATH
+
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Candidate values per parameter; None leaves Ghostscript's default
+PARAMETER_GRID = {
+    'NumRenderingThreads': sorted({None, max(1, CPU_COUNT // 2), CPU_COUNT}, key=lambda v: v or 0),
+    'BufferSpace': [None, 64 * 1024 * 1024],
+    'MaxBitmap': [None, 256 * 1024 * 1024],
+    'vmthreshold': [None, 32 * 1024 * 1024],
+}
+
+# Every class a document can be sorted into
+DOCUMENT_CLASSES = ('image', 'mixed', 'text')
+
+# PyMuPDF's built-in fonts, embedded in the generated mixed sample
+MIXED_SAMPLE_FONTS = ('tiro', 'tibo', 'helv', 'hebo')
+
+
+def parameter_combinations() -> List[Dict[str, int]]:
+    """Every tuning in the grid, without the parameters left at default"""
+    names = list(PARAMETER_GRID)
+    combinations = []
+    for values in itertools.product(*(PARAMETER_GRID[name] for name in names)):
+        combinations.append({name: value for name, value in zip(names, values) if value})
+    return combinations
+
+
+def generate_samples(directory: str) -> List[str]:
+    """Write one text, one image and one mixed sample PDF"""
+    import fitz
+    from PIL import Image
+    
+    def photo(width, height, noise):
+        # Smooth gradients with noise compress like scanned photos
+        gradient = Image.linear_gradient('L').resize((width, height))
+        noise = Image.effect_noise((width, height), noise)
+        return Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    
+    def image_stream(img, quality):
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality)
+        return buffer.getvalue()
+    
+    text = "The quick brown fox jumps over the lazy dog. " * 40
+    paths = []
+    
+    doc = fitz.open()
+    for _ in range(30):
+        doc.new_page().insert_textbox(fitz.Rect(50, 50, 545, 790), text, fontsize=10)
+    paths.append(os.path.join(directory, "sample_text.pdf"))
+    doc.save(paths[-1])
+    
+    doc = fitz.open()
+    for seed in range(6):
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=image_stream(photo(2400, 3200, 30 + seed * 5), 92))
+    paths.append(os.path.join(directory, "sample_image.pdf"))
+    doc.save(paths[-1])
+    
+    # Embedded fonts and small figures keep the image share between the
+    # text and image class thresholds
+    doc = fitz.open()
+    for seed in range(10):
+        page = doc.new_page()
+        # A resource name other than the built-in one makes PyMuPDF embed the font
+        for index, name in enumerate(MIXED_SAMPLE_FONTS):
+            page.insert_font(fontname=f"F{index}", fontbuffer=fitz.Font(name).buffer)
+        page.insert_textbox(fitz.Rect(50, 420, 545, 790), text, fontsize=10,
+                            fontname=f"F{seed % len(MIXED_SAMPLE_FONTS)}")
+        page.insert_image(fitz.Rect(50, 50, 545, 400), stream=image_stream(photo(320, 230, 4 + seed), 75))
+    paths.append(os.path.join(directory, "sample_mixed.pdf"))
+    doc.save(paths[-1], garbage=3, deflate=True)
+    
+    return paths
+
+
+def time_run(compressor: WorkingPDFCompressor, gs_path: str, input_path: str,
+             output_path: str, tuning: Dict[str, int], quality: int) -> Optional[float]:
+    """Seconds for one Ghostscript run, or None if it failed"""
+    cmd = compressor._ghostscript_command(gs_path, input_path, output_path, quality, tuning)
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=600)
+    except subprocess.TimeoutExpired:
+        return None
+    elapsed = time.perf_counter() - start
+    return elapsed if result.returncode == 0 else None
+
+
+def calibrate(sample_paths: List[str], runs: int = 3, quality: int = 60) -> dict:
+    """Measure every parameter combination and return the profile"""
+    compressor = WorkingPDFCompressor()
+    gs_path = compressor._get_ghostscript_path()
+    if not gs_path:
+        raise RuntimeError("Ghostscript not found")
+    
+    samples_by_class = {}
+    for path in sample_paths:
+        samples_by_class.setdefault(compressor._document_class(path), []).append(path)
+    
+    # A class without samples would silently keep Ghostscript's defaults
+    missing = [document_class for document_class in DOCUMENT_CLASSES if document_class not in samples_by_class]
+    if missing:
+        raise RuntimeError(f"No {', '.join(missing)} samples; give at least one PDF of every class")
+    
+    profile = {"host": compressor._host_key(gs_path), "calibrated_at": time.time(),
+               "quality": quality, "classes": {}}
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_path = os.path.join(work_dir, "output.pdf")
+        for document_class, paths in sorted(samples_by_class.items()):
+            results = []
+            for tuning in parameter_combinations():
+                # Total over the class's samples of the median over runs, and
+                # of the spread between the fastest and slowest run
+                total = spread = 0.0
+                for path in paths:
+                    timings = [time_run(compressor, gs_path, path, output_path, tuning, quality)
+                               for _ in range(runs)]
+                    if None in timings:
+                        total = None
+                        break
+                    total += statistics.median(timings)
+                    spread += max(timings) - min(timings)
+                if total is not None:
+                    results.append((total, spread, tuning))
+                    print(f"  {document_class:6} {total:7.3f}s ±{spread / 2:.3f}  {tuning or 'defaults'}")
+            
+            baseline = next((result for result in results if not result[2]), None)
+            if baseline is None:
+                continue  # Defaults failed, so nothing to compare against
+            
+            fastest = min(results, key=lambda result: result[0])
+            # Noise can only be told apart from a real gain with repeated runs
+            noise = fastest[1] + baseline[1] if runs > 1 else float("inf")
+            # Of everything within noise of the fastest, keep the fewest changes
+            # from the defaults (which are kept unless clearly beaten)
+            seconds, spread, tuning = min(
+                (result for result in results if result[0] - fastest[0] <= noise),
+                key=lambda result: (len(result[2]), result[0]))
+            
+            profile["classes"][document_class] = {
+                "tuning": tuning,
+                "seconds": round(seconds, 4),
+                "default_seconds": round(baseline[0], 4),
+                "spread_seconds": round(noise, 4) if runs > 1 else None,
+                "samples": len(paths),
+            }
+    
+    return profile
+
+
+def save_profile(profile: dict, path: str):
+    """Write the profile atomically"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as profile_file:
+        json.dump(profile, profile_file, indent=2)
+    os.replace(temp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate Ghostscript parameters for this host")
+    parser.add_argument("samples", nargs="*", help="sample PDFs (generated if omitted)")
+    parser.add_argument("--runs", type=int, default=3, help="runs per sample and combination")
+    parser.add_argument("--quality", type=int, default=60)
+    parser.add_argument("--profile", default=os.environ.get(GS_PROFILE_ENV, GS_PROFILE_PATH),
+                        help="where to save the profile")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as sample_dir:
+        samples = args.samples or generate_samples(sample_dir)
+        print(f"Calibrating {len(parameter_combinations())} parameter sets on {len(samples)} samples...")
+        try:
+            profile = calibrate(samples, args.runs, args.quality)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            return 1
+    
+    save_profile(profile, args.profile)
+    print(f"\nProfile saved to {args.profile}")
+    for document_class, entry in profile["classes"].items():
+        speedup = ""
+        if entry["tuning"] and entry["default_seconds"]:
+            speedup = f" ({entry['default_seconds'] / entry['seconds']:.2f}x vs defaults)"
+        print(f"  {document_class}: {entry['tuning'] or 'defaults'}{speedup}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,6 +9,10 @@ from working_pdf_compressor import WorkingPDFCompressor
 from drag_drop_handler import DragDropHandler, SimpleDragDropHandler
 
 
+# When set, the app quits as soon as its window is usable (see startup_benchmark.py)
+STARTUP_PROBE_ENV = "PDF_DOWNSIZING_STARTUP_PROBE"
+
+
 class PDFDownSizingApp:
     """Main application class for PDF compression tool"""
     
@@ -20,6 +24,9 @@ class PDFDownSizingApp:
         self.compressor = WorkingPDFCompressor()
         self.setup_drag_drop()
         
+        # Probe engines only after the window is up
+        self.root.after_idle(self.start_engine_discovery)
+        
     def setup_window(self):
         """Configure main window"""
         self.root.title("PDF DownSizing Tool_Dino v1.0")
@@ -167,6 +174,26 @@ class PDFDownSizingApp:
             # Fallback to simple drag and drop
             self.drag_drop = SimpleDragDropHandler(self.root, self.handle_dropped_file)
     
+    def start_engine_discovery(self):
+        """Find Ghostscript and load PDF libraries in the background"""
+        thread = threading.Thread(target=self.discover_engines)
+        thread.daemon = True
+        thread.start()
+    
+    def discover_engines(self):
+        """Discover compression engines (runs in separate thread)"""
+        engines = self.compressor.discover_engines()
+        engine_name = "Ghostscript" if engines['ghostscript'] else "built-in"
+        try:
+            self.root.after(0, lambda: self.show_engine_status(engine_name))
+        except (RuntimeError, tk.TclError):
+            pass  # Window already closed
+    
+    def show_engine_status(self, engine_name):
+        """Mention the selected engine while the app is idle"""
+        if self.status_var.get() == "Ready to compress PDF files":
+            self.status_var.set(f"Ready to compress PDF files ({engine_name} engine)")
+    
     def handle_dropped_file(self, file_path):
         """Handle dropped PDF file"""
         if file_path and os.path.exists(file_path):
@@ -284,6 +311,9 @@ def main():
     root = tk.Tk()
     app = PDFDownSizingApp(root)
     
+    if os.environ.get(STARTUP_PROBE_ENV):
+        root.after_idle(root.destroy)
+    
     try:
         root.mainloop()
     except KeyboardInterrupt:
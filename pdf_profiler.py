@@ -0,0 +1,294 @@
+"""
+Byte-size profiler: where the bytes in a PDF are going
+
+Walks the xref table once, reading only object dictionaries and stream
+lengths (stream data is never decoded), and attributes every object to a
+category: images, fonts, content streams, metadata, thumbnails,
+annotations, embedded files, document structure or other. Sizes are the
+raw stream length plus the length of the object's dictionary, so objects
+inside compressed object streams are counted at their uncompressed size;
+whatever the objects do not account for (xref tables, object stream
+overhead, padding) is reported as overhead.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+from typing import List, Optional
+
+from working_pdf_compressor import PDFSource, format_file_size
+
+
+CATEGORIES = ('images', 'fonts', 'content', 'metadata', 'thumbnails',
+              'annotations', 'embedded_files', 'structure', 'other', 'overhead')
+
+STRUCTURE_TYPES = {'/Catalog', '/Pages', '/Page', '/Outlines', '/ObjStm', '/XRef'}
+
+# Font dictionary entries whose objects belong to the font
+FONT_REFERENCE_KEYS = ('ToUnicode', 'CIDToGIDMap', 'Encoding', 'Widths', 'W', 'W2', 'CharProcs')
+
+FONT_FILE_KEYS = {'FontFile': 'Type1', 'FontFile2': 'TrueType', 'FontFile3': 'CFF'}
+
+INDIRECT_REF = re.compile(r'(\d+)\s+\d+\s+R')
+
+# Six capital letters and a plus sign mark a subset font (PDF 32000 9.6.4)
+SUBSET_PREFIX = re.compile(r'^/?[A-Z]{6}\+')
+
+
+class PDFProfiler:
+    """Attribute the bytes of a PDF to object categories"""
+    
+    def profile(self, source: PDFSource) -> dict:
+        """
+        Profile a PDF given as a path or as bytes
+        
+        Returns a JSON-serialisable dict with per-category totals, every
+        image (dimensions, filter, colour space) and every font descriptor
+        (embedded, subset), each list ranked by size.
+        """
+        import fitz
+        
+        if isinstance(source, bytes):
+            pdf_doc = fitz.open(stream=source, filetype='pdf')
+            file_size = len(source)
+        else:
+            pdf_doc = fitz.open(source)
+            file_size = os.path.getsize(source)
+        
+        try:
+            objects = {}
+            roles = {}
+            images = {}
+            fonts = {}
+            
+            def claim(refs: List[int], role: str):
+                for ref in refs:
+                    roles.setdefault(ref, role)
+            
+            for xref in range(1, pdf_doc.xref_length()):
+                try:
+                    obj_type = self._key(pdf_doc, xref, "Type")
+                    subtype = self._key(pdf_doc, xref, "Subtype")
+                    size = len(pdf_doc.xref_object(xref, compressed=True))
+                except Exception:
+                    continue  # Free or broken entry
+                if pdf_doc.xref_is_stream(xref):
+                    size += self._stream_length(pdf_doc, xref)
+                objects[xref] = (obj_type, subtype, size)
+                
+                if subtype == '/Image':
+                    images[xref] = self._image_entry(pdf_doc, xref, size)
+                    claim(self._refs(pdf_doc, xref, "SMask"), 'images')
+                    claim(self._refs(pdf_doc, xref, "Mask"), 'images')
+                    claim(self._refs(pdf_doc, xref, "ColorSpace"), 'images')
+                elif obj_type == '/Page':
+                    claim(self._refs(pdf_doc, xref, "Contents", resolve=True), 'content')
+                    claim(self._refs(pdf_doc, xref, "Thumb"), 'thumbnails')
+                    annots = self._refs(pdf_doc, xref, "Annots", resolve=True)
+                    claim(annots, 'annotations')
+                    for annot in annots:
+                        claim(self._refs(pdf_doc, annot, "AP"), 'annotations')
+                elif obj_type == '/Annot':
+                    claim(self._refs(pdf_doc, xref, "AP"), 'annotations')
+                elif obj_type == '/Font':
+                    for key in FONT_REFERENCE_KEYS:
+                        claim(self._refs(pdf_doc, xref, key), 'fonts')
+                elif obj_type == '/FontDescriptor':
+                    fonts[xref] = self._font_entry(pdf_doc, xref, size)
+                    claim([fonts[xref]["program_xref"]] if fonts[xref]["program_xref"] else [], 'fonts')
+                elif obj_type == '/Filespec':
+                    claim(self._refs(pdf_doc, xref, "EF"), 'embedded_files')
+            
+            info = INDIRECT_REF.search(pdf_doc.xref_get_key(-1, "Info")[1])
+            if info:
+                roles.setdefault(int(info.group(1)), 'metadata')
+        finally:
+            pdf_doc.close()
+        
+        # Font program sizes are only known once the whole table has been seen
+        for entry in fonts.values():
+            program = objects.get(entry["program_xref"])
+            if program:
+                entry["bytes"] += program[2]
+        
+        totals = {category: {"bytes": 0, "objects": 0} for category in CATEGORIES}
+        for xref, (obj_type, subtype, size) in objects.items():
+            category = self._category(obj_type, subtype, roles.get(xref))
+            if category is None:
+                continue
+            totals[category]["bytes"] += size
+            totals[category]["objects"] += 1
+        
+        attributed = sum(total["bytes"] for total in totals.values())
+        totals['overhead']["bytes"] = max(0, file_size - attributed)
+        for total in totals.values():
+            total["share"] = round(total["bytes"] / max(1, file_size), 4)
+        
+        return {
+            "file_size": file_size,
+            "objects": len(objects),
+            "categories": dict(sorted(totals.items(), key=lambda item: -item[1]["bytes"])),
+            "images": sorted(images.values(), key=lambda entry: -entry["bytes"]),
+            "fonts": sorted(fonts.values(), key=lambda entry: -entry["bytes"]),
+        }
+    
+    def format_report(self, profile: dict, top: int = 10) -> str:
+        """Human-readable ranked report of a profile"""
+        size = format_file_size
+        lines = [f"File size: {size(profile['file_size'])} ({profile['objects']} objects)", ""]
+        
+        lines.append("By category:")
+        for category, total in profile["categories"].items():
+            if total["bytes"]:
+                lines.append(f"  {category:15} {size(total['bytes']):>10}  {total['share'] * 100:5.1f}%"
+                             f"  {total['objects']} objects")
+        
+        if profile["images"]:
+            lines += ["", f"Largest images ({len(profile['images'])} total):"]
+            for entry in profile["images"][:top]:
+                mask = " (mask)" if entry["is_mask"] else ""
+                lines.append(f"  xref {entry['xref']:<6} {size(entry['bytes']):>10}  "
+                             f"{entry['width']}x{entry['height']} {entry['filter'] or 'raw'} "
+                             f"{entry['colorspace'] or ''}{mask}".rstrip())
+        
+        if profile["fonts"]:
+            embedded = [entry for entry in profile["fonts"] if entry["embedded"]]
+            full = [entry for entry in embedded if not entry["subset"]]
+            lines += ["", f"Fonts ({len(embedded)} embedded, {len(full)} not subset):"]
+            for entry in profile["fonts"][:top]:
+                if not entry["embedded"]:
+                    state = "not embedded"
+                elif entry["subset"]:
+                    state = f"subset {entry['format']}"
+                else:
+                    state = f"full {entry['format']}"
+                lines.append(f"  {entry['name']:30.30} {size(entry['bytes']):>10}  {state}")
+        
+        return "\n".join(lines)
+    
+    # Object inspection
+    
+    def _key(self, pdf_doc, xref: int, key: str) -> Optional[str]:
+        """A dictionary value as text, or None if it is absent"""
+        value_type, value = pdf_doc.xref_get_key(xref, key)
+        return None if value_type == 'null' else value
+    
+    def _refs(self, pdf_doc, xref: int, key: str, resolve: bool = False) -> List[int]:
+        """
+        Xrefs referenced by a dictionary value
+        
+        With resolve, a value that is a reference to an array (as /Contents
+        and /Annots may be) is followed one level.
+        """
+        value_type, value = pdf_doc.xref_get_key(xref, key)
+        refs = [int(ref) for ref in INDIRECT_REF.findall(value)]
+        if resolve and value_type == 'xref' and refs and not pdf_doc.xref_is_stream(refs[0]):
+            target = pdf_doc.xref_object(refs[0], compressed=True)
+            if target.lstrip().startswith('['):
+                refs += [int(ref) for ref in INDIRECT_REF.findall(target)]
+        return refs
+    
+    def _stream_length(self, pdf_doc, xref: int) -> int:
+        """Raw stream length from /Length, reading the data only if it is missing"""
+        value_type, value = pdf_doc.xref_get_key(xref, "Length")
+        try:
+            if value_type == 'int':
+                return int(value)
+            if value_type == 'xref':
+                return int(pdf_doc.xref_object(int(INDIRECT_REF.search(value).group(1))))
+        except (ValueError, AttributeError):
+            pass
+        return len(pdf_doc.xref_stream_raw(xref) or b'')
+    
+    def _image_entry(self, pdf_doc, xref: int, size: int) -> dict:
+        filters = self._key(pdf_doc, xref, "Filter") or ''
+        colorspace = self._key(pdf_doc, xref, "ColorSpace") or ''
+        if INDIRECT_REF.fullmatch(colorspace.strip()):
+            try:
+                colorspace = pdf_doc.xref_object(int(INDIRECT_REF.match(colorspace.strip()).group(1)),
+                                                 compressed=True)
+            except RuntimeError:
+                colorspace = ''  # Dangling reference
+        return {
+            "xref": xref,
+            "bytes": size,
+            "width": int(self._key(pdf_doc, xref, "Width") or 0),
+            "height": int(self._key(pdf_doc, xref, "Height") or 0),
+            "bits_per_component": int(self._key(pdf_doc, xref, "BitsPerComponent") or 0),
+            "filter": " ".join(name.lstrip('/') for name in re.findall(r'/\w+', filters)),
+            "colorspace": next(iter(re.findall(r'/(\w+)', colorspace)), ''),
+            "is_mask": self._key(pdf_doc, xref, "ImageMask") == 'true',
+        }
+    
+    def _font_entry(self, pdf_doc, xref: int, size: int) -> dict:
+        name = (self._key(pdf_doc, xref, "FontName") or '').lstrip('/')
+        program_xref, font_format = None, None
+        for key, key_format in FONT_FILE_KEYS.items():
+            refs = self._refs(pdf_doc, xref, key)
+            if refs:
+                program_xref = refs[0]
+                font_format = key_format
+                if key == 'FontFile3':
+                    font_format = (self._key(pdf_doc, program_xref, "Subtype") or '/CFF').lstrip('/')
+                break
+        return {
+            "xref": xref,
+            "name": name,
+            "bytes": size,
+            "embedded": program_xref is not None,
+            "subset": bool(SUBSET_PREFIX.match(name)),
+            "format": font_format,
+            "program_xref": program_xref,
+        }
+    
+    def _category(self, obj_type: Optional[str], subtype: Optional[str], role: Optional[str]) -> Optional[str]:
+        """Category of an object; its referrer's role wins over its own type"""
+        if obj_type in ('/ObjStm', '/XRef'):
+            return None  # Counted as overhead; their objects are counted one by one
+        if role:
+            return role
+        if subtype == '/Image':
+            return 'images'
+        if obj_type in ('/Font', '/FontDescriptor'):
+            return 'fonts'
+        if obj_type == '/Metadata':
+            return 'metadata'
+        if obj_type == '/EmbeddedFile':
+            return 'embedded_files'
+        if obj_type == '/Annot':
+            return 'annotations'
+        if subtype == '/Form':
+            return 'content'
+        if obj_type in STRUCTURE_TYPES:
+            return 'structure'
+        return 'other'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show where the bytes in a PDF are going")
+    parser.add_argument("pdf")
+    parser.add_argument("--json", metavar="PATH", help="also write the profile as JSON ('-' for stdout)")
+    parser.add_argument("--top", type=int, default=10, help="images and fonts to list")
+    args = parser.parse_args()
+    
+    profiler = PDFProfiler()
+    try:
+        profile = profiler.profile(args.pdf)
+    except Exception as e:
+        print(f"❌ Error profiling PDF: {str(e)}")
+        return 1
+    
+    if args.json == "-":
+        print(json.dumps(profile, indent=2, ensure_ascii=False))
+        return 0
+    
+    print(profiler.format_report(profile, args.top))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(profile, json_file, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
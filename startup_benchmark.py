@@ -0,0 +1,113 @@
+"""
+Startup benchmark for the GUI and the compressor module
+
+Measures, in fresh processes, how long it takes to import the compressor,
+to import the GUI module, and to get the main window usable. Heavy PDF
+libraries must not be loaded by any of these steps.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+from main import STARTUP_PROBE_ENV
+
+
+# Modules that should only be imported when a PDF is actually compressed
+HEAVY_MODULES = ["fitz", "pymupdf", "PIL", "PyPDF2", "numpy"]
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Tk errors that mean there is no display to open a window on
+NO_DISPLAY_ERRORS = ("no display name", "couldn't connect to display")
+
+IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {heavy!r} if name in sys.modules]
+print(elapsed, ",".join(loaded))
+"""
+
+
+def time_import(module, runs):
+    """Median import time of a module in fresh interpreters, plus heavy modules it loaded"""
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        code = IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                                text=True, check=True, cwd=PROJECT_DIR)
+        elapsed, names = result.stdout.split()[0], result.stdout.split()[1:]
+        timings.append(float(elapsed))
+        loaded.update(name for name in ",".join(names).split(",") if name)
+    return statistics.median(timings), sorted(loaded)
+
+
+class NoDisplayError(RuntimeError):
+    """The window could not be opened because no display is available"""
+
+
+def time_window(command, runs):
+    """Median time from process launch until the main window is usable"""
+    env = dict(os.environ, **{STARTUP_PROBE_ENV: "1"})
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(command, env=env, capture_output=True, text=True,
+                                timeout=60, cwd=PROJECT_DIR)
+        if result.returncode != 0:
+            error_lines = result.stderr.strip().splitlines()
+            message = error_lines[-1] if error_lines else f"exit code {result.returncode}"
+            if any(error in result.stderr for error in NO_DISPLAY_ERRORS):
+                raise NoDisplayError(message)
+            raise RuntimeError(message)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure PDF DownSizing Tool startup time")
+    parser.add_argument("--runs", type=int, default=5, help="launches per measurement")
+    parser.add_argument("--executable", help="frozen app to launch instead of 'python main.py'")
+    parser.add_argument("--max-seconds", type=float,
+                        help="fail if the window takes longer than this to become usable")
+    args = parser.parse_args()
+    
+    failed = False
+    
+    for module in ("working_pdf_compressor", "main"):
+        elapsed, loaded = time_import(module, args.runs)
+        print(f"import {module}: {elapsed * 1000:.1f} ms")
+        if loaded:
+            print(f"  ❌ heavy modules loaded at import: {', '.join(loaded)}")
+            failed = True
+    
+    command = [args.executable] if args.executable else [sys.executable, os.path.join(PROJECT_DIR, "main.py")]
+    try:
+        elapsed = time_window(command, args.runs)
+        print(f"window usable: {elapsed * 1000:.1f} ms")
+        if args.max_seconds is not None and elapsed > args.max_seconds:
+            print(f"  ❌ slower than {args.max_seconds:.2f} s")
+            failed = True
+    except NoDisplayError as e:
+        # A headless machine can still run the import checks, unless the
+        # window measurement was explicitly asked for
+        if args.executable or args.max_seconds is not None:
+            print(f"window usable: ❌ could not open a window ({e})")
+            failed = True
+        else:
+            print(f"window usable: skipped ({e})")
+    except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+        # Missing executable, crash on launch or hang
+        print(f"window usable: ❌ launch failed ({e})")
+        failed = True
+    
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,75 +2,375 @@
 Working PDF compressor with guaranteed compression
 """
 import os
-import tempfile
+import io
+import re
+import json
+import zlib
+import socket
+import shutil
+import importlib
+import threading
 import subprocess
-from typing import Tuple, Optional
+from typing import BinaryIO, Dict, Iterator, List, Tuple, Optional, Union
+
+
+# A PDF given as a file path or as its bytes
+PDFSource = Union[str, bytes]
+
+# Where compressed output goes: a file path or an in-memory buffer
+PDFTarget = Union[str, io.BytesIO]
+
+
+# Target image resolutions (DPI) the fallback engine downsamples to
+DPI_TIERS = (72, 96, 150, 200, 300)
+
+# Only downsample when an image exceeds its target DPI by this factor
+# (same default as Ghostscript's ColorImageDownsampleThreshold)
+DOWNSAMPLE_THRESHOLD = 1.5
+
+# Images with a side above this are decoded incrementally where possible
+LARGE_IMAGE_SIDE = 3000
+
+# Rows per strip when decoding and resampling images
+STRIP_ROWS = 256
+
+# Content stream tokenizing for locating image placements
+CONTENT_WHITESPACE = re.compile(rb'[\x00\t\n\x0c\r ]*')
+CONTENT_NEWLINE = re.compile(rb'[\r\n]')
+CONTENT_TOKEN = re.compile(rb'/?[^\x00\t\n\x0c\r ()<>\[\]{}/%]*')
+CONTENT_INLINE_END = re.compile(rb'[\x00\t\n\x0c\r ]EI(?=[\x00\t\n\x0c\r ]|$)')
+
+# JPEG quality range searched when targeting a perceptual quality
+SSIM_QUALITY_RANGE = (20, 95)
+
+# Upper bound on trial encodes per image in that search
+SSIM_MAX_PROBES = 6
+
+# Luminance is compared at no more than this many pixels per side
+SSIM_MAX_SIDE = 512
+
+# SSIM window size in pixels
+SSIM_WINDOW = 7
+
+# Measured Ghostscript settings for this host, written by gs_calibration.py
+GS_PROFILE_ENV = "PDF_DOWNSIZING_GS_PROFILE"
+GS_PROFILE_PATH = os.path.join(os.path.expanduser("~"), ".pdf_downsizing", "gs_profile.json")
+
+# Share of file bytes in image streams that makes a document image- or text-heavy
+IMAGE_CLASS_RATIO = 0.6
+TEXT_CLASS_RATIO = 0.1
+
+# Byte translation table that inverts 8-bit samples
+INVERT_BYTES = bytes(range(255, -1, -1))
+
+# Channels per sample for color spaces that can be decoded without PyMuPDF
+STREAMABLE_COLORSPACES = {'/DeviceGray': 1, '/DeviceRGB': 3, '/DeviceCMYK': 4}
+
+# What the optional strip stage removes after compression. 'safe' keeps
+# everything a reader can see or a standard relies on: XMP stays (PDF/A
+# declares conformance in it), attachments stay, and fonts are not subset
+# in fillable forms, whose fields need the full font to accept new text.
+STRIP_PROFILES = {
+    'safe': {
+        'thumbnails': True,      # Page /Thumb images
+        'piece_info': True,      # Private application data (/PieceInfo)
+        'xmp': False,            # /Metadata streams
+        'attachments': False,    # Document-level embedded files
+        'subset_fonts': 'unless_forms',
+    },
+    'aggressive': {
+        'thumbnails': True,
+        'piece_info': True,
+        'xmp': True,
+        'attachments': True,
+        'subset_fonts': True,
+    },
+}
+
+# A strip profile name or a policy dict with the keys above
+StripPolicy = Union[str, Dict[str, object]]
+
+# Result message when no engine could make the file smaller
+NOT_REDUCED_MESSAGE = "File is already well optimized. The original was kept, as compressing would not make it smaller."
+
+# The reduction figure in an engine's result message
+REDUCTION_FIGURE = re.compile(r'Size reduced by -?[\d.]+%')
+
+# A linearized file announces itself in the first object (PDF 32000 Annex F)
+LINEARIZED_HEADER_BYTES = 1024
+
+
+def format_file_size(size_bytes: int) -> str:
+    """Format file size in human readable format"""
+    if size_bytes == 0:
+        return "0 B"
+    
+    size_names = ["B", "KB", "MB", "GB"]
+    i = 0
+    while size_bytes >= 1024 and i < len(size_names) - 1:
+        size_bytes /= 1024.0
+        i += 1
+    
+    return f"{size_bytes:.1f} {size_names[i]}"
 
 
 class WorkingPDFCompressor:
     """PDF compressor that guarantees some compression"""
     
     def __init__(self):
-        self.temp_dir = None
+        # Ghostscript is probed once, possibly from a background thread
+        self._ghostscript_path = None
+        self._ghostscript_probed = False
+        self._ghostscript_lock = threading.Lock()
+        self._ghostscript_profile = None
+        self._ghostscript_profile_loaded = False
+        self._document_classes = {}
     
-    def compress_pdf(self, input_path: str, output_path: str, quality: int = 80) -> Tuple[bool, str]:
+    def compress_pdf(self, input_path: str, output_path: str, quality: int = 80,
+                     target_ssim: Optional[float] = None, strip: Optional[StripPolicy] = None,
+                     linearize: bool = False) -> Tuple[bool, str]:
         """
         Compress PDF with guaranteed results
         """
+        # Validate quality parameter first
+        if not 1 <= quality <= 100:
+            return False, "Quality must be between 1 and 100"
+        
+        if target_ssim is not None and not 0 < target_ssim < 1:
+            return False, "Target SSIM must be between 0 and 1"
+        
+        if isinstance(strip, str) and strip not in STRIP_PROFILES:
+            return False, f"Unknown strip profile: {strip}"
+        
+        # Check if input file exists
+        if not input_path or not os.path.exists(input_path):
+            return False, f"Input file does not exist: {input_path}"
+        
+        return self._compress(input_path, output_path, quality, target_ssim, strip, linearize)
+    
+    def compress_bytes(self, data: bytes, quality: int = 80, target_ssim: Optional[float] = None,
+                       strip: Optional[StripPolicy] = None,
+                       linearize: bool = False) -> Tuple[bool, str, Optional[bytes]]:
+        """Compress an in-memory PDF; returns (success, message, compressed_data)"""
+        if not data:
+            return False, "Input data is empty", None
+        
+        if target_ssim is not None and not 0 < target_ssim < 1:
+            return False, "Target SSIM must be between 0 and 1", None
+        
+        if isinstance(strip, str) and strip not in STRIP_PROFILES:
+            return False, f"Unknown strip profile: {strip}", None
+        
+        # No files are created here, though Ghostscript spools a PDF read
+        # from stdin into a temporary file of its own (PDF needs random access)
+        output = io.BytesIO()
+        success, message = self._compress(bytes(data), output, quality, target_ssim, strip, linearize)
+        return success, message, output.getvalue() if success else None
+    
+    def compress_fileobj(self, input_file: BinaryIO, output_file: BinaryIO, quality: int = 80,
+                         target_ssim: Optional[float] = None, strip: Optional[StripPolicy] = None,
+                         linearize: bool = False) -> Tuple[bool, str]:
+        """Compress a PDF read from one binary file object into another"""
+        success, message, data = self.compress_bytes(input_file.read(), quality, target_ssim,
+                                                     strip, linearize)
+        if success:
+            output_file.write(data)
+        return success, message
+    
+    def _compress(self, source: PDFSource, target: PDFTarget, quality: int,
+                  target_ssim: Optional[float] = None, strip: Optional[StripPolicy] = None,
+                  linearize: bool = False) -> Tuple[bool, str]:
+        """Run the engines in order on a path or in-memory PDF, then the output stages"""
         try:
-            # Validate quality parameter first
-            if not 1 <= quality <= 100:
-                return False, "Quality must be between 1 and 100"
-            
-            # Check if input file exists
-            if not input_path or not os.path.exists(input_path):
-                return False, f"Input file does not exist: {input_path}"
-            
-            # Check if Ghostscript is available
-            if not self._check_ghostscript():
-                return self._fallback_compression(input_path, output_path, quality)
-            
-            # Create temporary directory
-            self.temp_dir = tempfile.mkdtemp()
-            
-            original_size = os.path.getsize(input_path)
-            
-            # Use quality-based Ghostscript compression
-            success, message = self._strategy_1(input_path, output_path, quality)
-            if success:
-                compressed_size = os.path.getsize(output_path)
-                if compressed_size < original_size:
-                    compression_ratio = (1 - compressed_size / original_size) * 100
-                    return True, f"Successfully compressed! Size reduced by {compression_ratio:.1f}% (Ghostscript)"
-                else:
-                    # Even if no compression, if file was processed successfully
-                    compression_ratio = (compressed_size / original_size - 1) * 100
-                    return True, f"File processed. Size increased by {compression_ratio:.1f}%. Try lowering quality setting."
-            
-            # If all strategies failed, use fallback
-            return self._fallback_compression(input_path, output_path, quality)
+            success, message = self._run_engines(source, target, quality, target_ssim)
+            if success and strip:
+                message += self._strip_target(target, strip)
+            # Last, since any rewrite after it would undo the layout
+            if success and linearize:
+                message += self._linearize_target(target, self._source_size(source))
+            # The engines measured their reduction before these stages ran
+            if success and (strip or linearize):
+                message = self._final_message(message, source, target)
+            return success, message
         
         except Exception as e:
             return False, f"Error compressing PDF: {str(e)}"
-        finally:
-            # Clean up temporary directory
-            if self.temp_dir and os.path.exists(self.temp_dir):
-                try:
-                    import shutil
-                    shutil.rmtree(self.temp_dir)
-                except:
-                    pass
     
-    def _strategy_1(self, input_path: str, output_path: str, quality: int) -> Tuple[bool, str]:
-        """Quality-based compression strategy"""
+    def _run_engines(self, source: PDFSource, target: PDFTarget, quality: int,
+                     target_ssim: Optional[float] = None) -> Tuple[bool, str]:
+        """Ghostscript first, then the PyMuPDF/PyPDF2 fallback"""
+        # Validate quality parameter first
+        if not 1 <= quality <= 100:
+            return False, "Quality must be between 1 and 100"
+        
+        # Check if Ghostscript is available (per-image quality needs PyMuPDF)
+        if target_ssim is not None or not self._check_ghostscript():
+            return self._fallback_compression(source, target, quality, target_ssim)
+        
+        original_size = self._source_size(source)
+        
+        # Use quality-based Ghostscript compression
+        success, message = self._strategy_1(source, target, quality)
+        if success:
+            return self._ghostscript_result(source, target, original_size)
+        
+        # If all strategies failed, use fallback
+        return self._fallback_compression(source, target, quality)
+    
+    def _ghostscript_result(self, source: PDFSource, target: PDFTarget, original_size: int) -> Tuple[bool, str]:
+        """Outcome of a successful Ghostscript run; a larger output is replaced by the original"""
+        compressed_size = self._target_size(target)
+        if compressed_size < original_size:
+            compression_ratio = (1 - compressed_size / original_size) * 100
+            return True, f"Successfully compressed! Size reduced by {compression_ratio:.1f}% (Ghostscript)"
+        
+        self._keep_original(source, target)
+        return True, NOT_REDUCED_MESSAGE
+    
+    def _strip_target(self, target: PDFTarget, strip: StripPolicy) -> str:
+        """Apply a strip policy to an output in place if that makes it smaller; returns a note"""
+        import fitz
+        
+        policy = STRIP_PROFILES[strip] if isinstance(strip, str) else strip
+        data = self._read_target(target)
+        
+        # The stage is optional, so a failure keeps the engine's output
+        try:
+            pdf_doc = fitz.open(stream=data, filetype='pdf')
+            try:
+                self._strip_document(pdf_doc, policy)
+                stripped = pdf_doc.tobytes(garbage=3, deflate=True)
+            finally:
+                pdf_doc.close()
+        except Exception as e:
+            return f" Not stripped: {str(e)}."
+        
+        if len(stripped) >= len(data):
+            return ""
+        self._write_target(target, stripped)
+        return f" Stripped {self.format_file_size(len(data) - len(stripped))} of unneeded data."
+    
+    def _strip_document(self, pdf_doc, policy: Dict[str, object]):
+        """Remove what the policy allows from an open document"""
+        # Dropping the references is enough; the objects are garbage-collected on save
+        for xref in range(1, pdf_doc.xref_length()):
+            try:
+                if policy.get('piece_info') and pdf_doc.xref_get_key(xref, "PieceInfo")[0] != 'null':
+                    pdf_doc.xref_set_key(xref, "PieceInfo", "null")
+                if policy.get('thumbnails') and pdf_doc.xref_get_key(xref, "Thumb")[0] != 'null':
+                    pdf_doc.xref_set_key(xref, "Thumb", "null")
+                if policy.get('xmp') and pdf_doc.xref_get_key(xref, "Metadata")[0] != 'null':
+                    pdf_doc.xref_set_key(xref, "Metadata", "null")
+            except Exception:
+                continue  # Free or broken entry
+        
+        if policy.get('attachments'):
+            for name in pdf_doc.embfile_names():
+                pdf_doc.embfile_del(name)
+        
+        subset_fonts = policy.get('subset_fonts')
+        if subset_fonts == 'unless_forms':
+            subset_fonts = not pdf_doc.is_form_pdf
+        if subset_fonts:
+            pdf_doc.subset_fonts()
+    
+    def _linearize_target(self, target: PDFTarget, original_size: int) -> str:
+        """Rewrite an output as a linearized PDF; returns a note for the result message"""
+        try:
+            import pikepdf
+        except ImportError:
+            return " Not linearized: pikepdf is not installed."
+        
+        data = self._read_target(target)
+        if b'/Linearized' in data[:LINEARIZED_HEADER_BYTES]:
+            return ""
+        
+        output = io.BytesIO()
+        try:
+            with pikepdf.open(io.BytesIO(data)) as pdf:
+                pdf.save(output, linearize=True)
+        except Exception as e:
+            return f" Not linearized: {str(e)}."
+        # Hint tables add a little; never exceeding the original comes first
+        if output.getbuffer().nbytes > original_size:
+            return " Not linearized: it would be larger than the original."
+        self._write_target(target, output.getvalue())
+        return " Linearized for fast web view."
+    
+    def _final_message(self, message: str, source: PDFSource, target: PDFTarget) -> str:
+        """Restate an engine's result message with the reduction of the final output"""
+        original_size = self._source_size(source)
+        final_size = self._target_size(target)
+        reduction = f"Size reduced by {(1 - final_size / original_size) * 100:.1f}%"
+        if REDUCTION_FIGURE.search(message):
+            return REDUCTION_FIGURE.sub(reduction, message, count=1)
+        if message.startswith(NOT_REDUCED_MESSAGE) and final_size < original_size:
+            return f"Successfully compressed! {reduction}." + message[len(NOT_REDUCED_MESSAGE):]
+        return message
+    
+    def _source_size(self, source: PDFSource) -> int:
+        """Size in bytes of a path or in-memory PDF"""
+        return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    
+    def _target_size(self, target: PDFTarget) -> int:
+        """Size in bytes of the output written so far"""
+        return os.path.getsize(target) if isinstance(target, str) else target.getbuffer().nbytes
+    
+    def _keep_original(self, source: PDFSource, target: PDFTarget):
+        """Make the target an exact copy of the source"""
+        if isinstance(source, bytes):
+            self._write_target(target, source)
+        elif isinstance(target, str):
+            shutil.copy2(source, target)
+        else:
+            with open(source, 'rb') as input_file:
+                self._write_target(target, input_file.read())
+    
+    def _read_target(self, target: PDFTarget) -> bytes:
+        """Everything written to a target so far"""
+        if isinstance(target, str):
+            with open(target, 'rb') as input_file:
+                return input_file.read()
+        return target.getvalue()
+    
+    def _open_target(self, target: PDFTarget) -> BinaryIO:
+        """Open a target for (re)writing from the start"""
+        if isinstance(target, str):
+            return open(target, 'wb')
+        target.seek(0)
+        target.truncate()
+        return target
+    
+    def _write_target(self, target: PDFTarget, data: bytes):
+        """Replace the contents of a target with data"""
+        if isinstance(target, str):
+            with open(target, 'wb') as output_file:
+                output_file.write(data)
+        else:
+            self._open_target(target).write(data)
+    
+    def _strategy_1(self, source: PDFSource, target: PDFTarget, quality: int) -> Tuple[bool, str]:
+        """Quality-based compression strategy; in-memory PDFs go through stdin and stdout"""
         # Get Ghostscript path
         gs_path = self._get_ghostscript_path()
         if not gs_path:
             return False, "Ghostscript not found"
         
-        # Map quality (1-100) to resolution (72-300)
-        # More aggressive mapping - lower resolutions
-        resolution = max(72, min(300, int(50 + (quality / 100.0) * 250)))
+        cmd = self._ghostscript_command(gs_path, source, target, quality)
+        result = subprocess.run(cmd, input=source if isinstance(source, bytes) else None,
+                                capture_output=True, timeout=60)
+        if result.returncode == 0 and not isinstance(target, str):
+            self._write_target(target, result.stdout)
+        return result.returncode == 0, result.stderr.decode(errors='replace')
+    
+    def _ghostscript_command(self, gs_path: str, source: PDFSource, target: PDFTarget,
+                             quality: int, tuning: Optional[Dict[str, int]] = None) -> List[str]:
+        """Build the Ghostscript command line; in-memory source/target use stdin/stdout"""
+        # Performance parameters measured by gs_calibration.py for the document's class
+        if tuning is None:
+            tuning = self._ghostscript_tuning(gs_path, source)
+        
+        resolution = self._target_resolution(quality)
         
         # Choose PDF settings based on quality
         if quality < 30:
@@ -103,12 +403,93 @@ class WorkingPDFCompressor:
             '-dAutoFilterGrayImages=false',
             '-dColorImageFilter=/DCTEncode',
             '-dGrayImageFilter=/DCTEncode',
-            f'-sOutputFile={output_path}',
-            input_path
+            f'-sOutputFile={target if isinstance(target, str) else "-"}',
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        return result.returncode == 0, result.stderr
+        # Performance parameters
+        for name in ('NumRenderingThreads', 'BufferSpace', 'MaxBitmap'):
+            if tuning.get(name):
+                cmd.append(f'-d{name}={tuning[name]}')
+        if tuning.get('vmthreshold'):
+            cmd += ['-c', f'{tuning["vmthreshold"]} setvmthreshold', '-f']
+        
+        cmd.append(source if isinstance(source, str) else '-')
+        return cmd
+    
+    def _ghostscript_tuning(self, gs_path: str, source: PDFSource) -> Dict[str, int]:
+        """Calibrated Ghostscript parameters for this host and document class"""
+        profile = self._load_ghostscript_profile()
+        if not profile or profile.get('host') != self._host_key(gs_path):
+            return {}
+        
+        # A class's tuning is only used for documents of that class
+        classes = profile.get('classes', {})
+        if not any(entry.get('tuning') for entry in classes.values()):
+            return {}
+        return classes.get(self._document_class(source), {}).get('tuning', {})
+    
+    def _load_ghostscript_profile(self) -> Optional[dict]:
+        """Read the calibration profile once"""
+        if not self._ghostscript_profile_loaded:
+            path = os.environ.get(GS_PROFILE_ENV, GS_PROFILE_PATH)
+            try:
+                with open(path, 'r', encoding='utf-8') as profile_file:
+                    self._ghostscript_profile = json.load(profile_file)
+            except (OSError, ValueError):
+                self._ghostscript_profile = None
+            self._ghostscript_profile_loaded = True
+        return self._ghostscript_profile
+    
+    def _host_key(self, gs_path: str) -> str:
+        """Identifies the machine and Ghostscript a profile was measured with"""
+        return f"{socket.gethostname()}:{os.cpu_count()}:{gs_path}"
+    
+    def _document_class(self, source: PDFSource) -> str:
+        """Classify a PDF as 'image', 'text' or 'mixed' by bytes held in image streams"""
+        key = None
+        if isinstance(source, str):
+            try:
+                stat = os.stat(source)
+            except OSError:
+                return 'mixed'
+            key = (os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+            if key in self._document_classes:
+                return self._document_classes[key]
+        
+        try:
+            image_bytes = self._image_stream_bytes(source)
+        except Exception:
+            return 'mixed'
+        
+        image_ratio = image_bytes / max(1, self._source_size(source))
+        if image_ratio >= IMAGE_CLASS_RATIO:
+            document_class = 'image'
+        elif image_ratio <= TEXT_CLASS_RATIO:
+            document_class = 'text'
+        else:
+            document_class = 'mixed'
+        if key:
+            self._document_classes[key] = document_class
+        return document_class
+    
+    def _image_stream_bytes(self, source: PDFSource) -> int:
+        """Stored length of all image streams, read from their dictionaries only"""
+        import fitz
+        
+        pdf_doc = fitz.open(stream=source, filetype='pdf') if isinstance(source, bytes) else fitz.open(source)
+        try:
+            image_bytes = 0
+            for xref in range(1, pdf_doc.xref_length()):
+                if pdf_doc.xref_get_key(xref, "Subtype")[1] != '/Image':
+                    continue
+                value_type, value = pdf_doc.xref_get_key(xref, "Length")
+                if value_type == 'xref':
+                    value_type, value = 'int', pdf_doc.xref_object(int(value.split()[0]))
+                if value_type == 'int' and value.strip().isdigit():
+                    image_bytes += int(value)
+            return image_bytes
+        finally:
+            pdf_doc.close()
     
     def _strategy_2(self, input_path: str, output_path: str, quality: int) -> Tuple[bool, str]:
         """Medium compression strategy"""
@@ -152,8 +533,28 @@ class WorkingPDFCompressor:
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
         return result.returncode == 0, result.stderr
     
+    def discover_engines(self) -> Dict[str, bool]:
+        """Probe Ghostscript and import the Python engines ahead of first use (thread-safe)"""
+        engines = {'ghostscript': self._check_ghostscript()}
+        for name, module in (('pymupdf', 'fitz'), ('pillow', 'PIL.Image'), ('pypdf2', 'PyPDF2'),
+                             ('pikepdf', 'pikepdf')):
+            try:
+                importlib.import_module(module)
+                engines[name] = True
+            except ImportError:
+                engines[name] = False
+        return engines
+    
     def _get_ghostscript_path(self) -> Optional[str]:
         """Get Ghostscript executable path"""
+        with self._ghostscript_lock:
+            if not self._ghostscript_probed:
+                self._ghostscript_path = self._find_ghostscript()
+                self._ghostscript_probed = True
+            return self._ghostscript_path
+    
+    def _find_ghostscript(self) -> Optional[str]:
+        """Search common locations for a working Ghostscript executable"""
         # Common Ghostscript locations
         possible_paths = [
             'gs',  # System PATH
@@ -177,22 +578,465 @@ class WorkingPDFCompressor:
         """Check if Ghostscript is available"""
         return self._get_ghostscript_path() is not None
     
-    def _fallback_compression(self, input_path: str, output_path: str, quality: int) -> Tuple[bool, str]:
+    def _target_resolution(self, quality: int) -> int:
+        """Map quality (1-100) to image resolution (72-300 DPI)"""
+        # More aggressive mapping - lower resolutions
+        return max(72, min(300, int(50 + (quality / 100.0) * 250)))
+    
+    def _target_dpi_tier(self, quality: int) -> int:
+        """Snap the quality-based resolution down to the nearest DPI tier"""
+        resolution = self._target_resolution(quality)
+        return max(tier for tier in DPI_TIERS if tier <= resolution)
+    
+    def _collect_effective_dpi(self, pdf_doc) -> Dict[int, float]:
+        """Map each image xref to its effective DPI on the page"""
+        effective_dpi = {}
+        for page in pdf_doc:
+            sizes = {img[0]: (img[2], img[3]) for img in page.get_images(full=True)}
+            for xref, matrix in self._image_placements(pdf_doc, page):
+                if xref not in sizes:
+                    continue
+                
+                # Drawn size in points, robust to rotation and skew
+                drawn_width = (matrix.a ** 2 + matrix.b ** 2) ** 0.5
+                drawn_height = (matrix.c ** 2 + matrix.d ** 2) ** 0.5
+                if drawn_width <= 0 or drawn_height <= 0:
+                    continue
+                
+                width, height = sizes[xref]
+                dpi = min(width * 72.0 / drawn_width, height * 72.0 / drawn_height)
+                # Stay sharp in the largest of several placements
+                if xref not in effective_dpi or dpi < effective_dpi[xref]:
+                    effective_dpi[xref] = dpi
+        
+        return effective_dpi
+    
+    def _image_placements(self, pdf_doc, page) -> Iterator[Tuple[int, object]]:
+        """Yield (xref, matrix) for every image drawn on a page"""
+        import fitz
+        
+        # The content streams are walked for q/Q/cm/Do only, because
+        # page.get_image_rects makes MuPDF decode each image in full
+        
+        # Map (container xref, resource name) to image and form xrefs
+        images = {(img[9], img[7]): img[0] for img in page.get_images(full=True)}
+        forms = {(form[2], form[1]): form[0] for form in page.get_xobjects()}
+        
+        def walk(content: bytes, container: int, ctm, depth: int):
+            stack = []
+            operands = []
+            for token in self._content_tokens(content):
+                if token[:1] == b'/':
+                    operands.append(token[1:].decode('latin-1'))
+                    continue
+                try:
+                    operands.append(float(token))
+                    continue
+                except ValueError:
+                    pass
+                
+                if token == b'q':
+                    stack.append(ctm)
+                elif token == b'Q':
+                    if stack:
+                        ctm = stack.pop()
+                elif token == b'cm' and len(operands) >= 6:
+                    ctm = fitz.Matrix(*operands[-6:]) * ctm
+                elif token == b'Do' and operands and isinstance(operands[-1], str):
+                    name = operands[-1]
+                    if (container, name) in images:
+                        yield images[(container, name)], ctm
+                    elif (container, name) in forms and depth < 16:
+                        form_xref = forms[(container, name)]
+                        form_matrix = fitz.Matrix(1, 0, 0, 1, 0, 0)
+                        matrix_type, matrix_value = pdf_doc.xref_get_key(form_xref, "Matrix")
+                        if matrix_type == 'array':
+                            form_matrix = fitz.Matrix(*[float(v) for v in matrix_value.strip('[]').split()])
+                        yield from walk(pdf_doc.xref_stream(form_xref) or b'', form_xref,
+                                        form_matrix * ctm, depth + 1)
+                operands = []
+        
+        yield from walk(page.read_contents(), 0, fitz.Matrix(1, 0, 0, 1, 0, 0), 0)
+    
+    def _content_tokens(self, content: bytes) -> Iterator[bytes]:
+        """Split a content stream into tokens, skipping strings and inline images"""
+        pos, end = 0, len(content)
+        while pos < end:
+            match = CONTENT_WHITESPACE.match(content, pos)
+            pos = match.end()
+            if pos >= end:
+                break
+            
+            char = content[pos:pos + 1]
+            if char == b'%':
+                newline = CONTENT_NEWLINE.search(content, pos)
+                pos = newline.end() if newline else end
+            elif char == b'(':
+                # Literal strings may nest balanced parentheses
+                depth = 0
+                while pos < end:
+                    char = content[pos:pos + 1]
+                    if char == b'\\':
+                        pos += 1
+                    elif char == b'(':
+                        depth += 1
+                    elif char == b')':
+                        depth -= 1
+                        if depth == 0:
+                            pos += 1
+                            break
+                    pos += 1
+                yield b'()'
+            elif content.startswith(b'<<', pos) or content.startswith(b'>>', pos):
+                yield content[pos:pos + 2]
+                pos += 2
+            elif char == b'<':
+                close = content.find(b'>', pos)
+                pos = close + 1 if close >= 0 else end
+                yield b'<>'
+            elif char in b'[]{}>':
+                yield char
+                pos += 1
+            else:
+                match = CONTENT_TOKEN.match(content, pos)
+                token = match.group()
+                if not token:
+                    pos += 1  # Stray delimiter
+                    continue
+                pos = match.end()
+                yield token
+                if token == b'ID':
+                    # Skip inline image data up to the EI operator
+                    data_end = CONTENT_INLINE_END.search(content, pos + 1)
+                    pos = data_end.end() if data_end else end
+    
+    def _replace_image_stream(self, pdf_doc, xref: int, jpeg_data: bytes,
+                              width: int, height: int, mode: str):
+        """Replace an image XObject with JPEG data of a new size"""
+        pdf_doc.update_stream(xref, jpeg_data, compress=False)
+        pdf_doc.xref_set_key(xref, "Filter", "/DCTDecode")
+        pdf_doc.xref_set_key(xref, "Width", str(width))
+        pdf_doc.xref_set_key(xref, "Height", str(height))
+        pdf_doc.xref_set_key(xref, "BitsPerComponent", "8")
+        pdf_doc.xref_set_key(xref, "ColorSpace", "/DeviceGray" if mode == 'L' else "/DeviceRGB")
+        # Pixmap samples are already decoded
+        pdf_doc.xref_set_key(xref, "DecodeParms", "null")
+        pdf_doc.xref_set_key(xref, "Decode", "null")
+    
+    def _replace_mask_stream(self, pdf_doc, xref: int, mask_img):
+        """Replace a soft mask XObject with losslessly compressed gray data"""
+        pdf_doc.update_stream(xref, mask_img.tobytes(), compress=True)
+        pdf_doc.xref_set_key(xref, "Width", str(mask_img.width))
+        pdf_doc.xref_set_key(xref, "Height", str(mask_img.height))
+        pdf_doc.xref_set_key(xref, "BitsPerComponent", "8")
+        pdf_doc.xref_set_key(xref, "ColorSpace", "/DeviceGray")
+        pdf_doc.xref_set_key(xref, "DecodeParms", "null")
+        pdf_doc.xref_set_key(xref, "Decode", "null")
+    
+    def _add_mask_stream(self, pdf_doc, xref: int, mask_img):
+        """Attach a new soft mask built from an image's own alpha channel"""
+        mask_xref = pdf_doc.get_new_xref()
+        pdf_doc.update_object(mask_xref, "<< /Type /XObject /Subtype /Image >>")
+        self._replace_mask_stream(pdf_doc, mask_xref, mask_img)
+        pdf_doc.xref_set_key(xref, "SMask", f"{mask_xref} 0 R")
+        pdf_doc.xref_set_key(xref, "SMaskInData", "null")
+    
+    def _open_image_strips(self, pdf_doc, xref: int, new_size: Tuple[int, int],
+                           large: bool) -> Tuple[int, int, str, Iterator[bytes]]:
+        """Open an image XObject as (width, height, mode, strips) with mode L, RGB, LA or RGBA"""
+        # A large image is streamed or refused, never decoded whole
+        if large:
+            source = self._open_flate_strips(pdf_doc, xref) or self._open_jpeg_strips(pdf_doc, xref, new_size)
+            if not source:
+                raise ValueError("Large image cannot be decoded incrementally")
+            return source
+        
+        import fitz
+        pix = fitz.Pixmap(pdf_doc, xref)
+        if pix.colorspace is None:
+            raise ValueError("Stencil masks are not recompressed")
+        
+        return (pix.width, pix.height, self._strip_mode(pix.colorspace.name, pix.alpha),
+                self._pixmap_strips(pix))
+    
+    def _strip_mode(self, colorspace: str, alpha: bool) -> str:
+        """PIL mode of converted strips for a MuPDF color space name"""
+        # Only gray and RGB samples pass through; every other space becomes RGB
+        if colorspace == 'DeviceGray':
+            return 'LA' if alpha else 'L'
+        return 'RGBA' if alpha else 'RGB'
+    
+    def _pixmap_strips(self, pix) -> Iterator[bytes]:
+        """Slice a decoded pixmap into strips, converting colors per strip"""
+        import fitz
+        
+        samples = pix.samples_mv
+        for y in range(0, pix.height, STRIP_ROWS):
+            rows = min(STRIP_ROWS, pix.height - y)
+            strip = samples[y * pix.stride:(y + rows) * pix.stride]
+            if pix.colorspace.name in ('DeviceGray', 'DeviceRGB'):
+                yield bytes(strip)
+            else:
+                # Other spaces are converted only one strip at a time
+                part = fitz.Pixmap(pix.colorspace, pix.width, rows, bytes(strip), pix.alpha)
+                yield fitz.Pixmap(fitz.csRGB, part).samples
+    
+    def _open_flate_strips(self, pdf_doc, xref: int):
+        """Stream rows out of a Flate image, with or without PNG predictors, without decoding it whole"""
+        import fitz
+        from PIL import Image
+        
+        colorspace = pdf_doc.xref_get_key(xref, "ColorSpace")[1]
+        if (pdf_doc.xref_get_key(xref, "Filter")[1] != '/FlateDecode' or
+                colorspace not in STREAMABLE_COLORSPACES or
+                pdf_doc.xref_get_key(xref, "BitsPerComponent")[1] != '8' or
+                pdf_doc.xref_get_key(xref, "Decode")[0] != 'null'):
+            return None
+        
+        width = int(pdf_doc.xref_get_key(xref, "Width")[1])
+        height = int(pdf_doc.xref_get_key(xref, "Height")[1])
+        components = STREAMABLE_COLORSPACES[colorspace]
+        raw_mode = {1: 'L', 3: 'RGB', 4: 'CMYK'}[components]
+        
+        predictor = pdf_doc.xref_get_key(xref, "DecodeParms/Predictor")[1]
+        predicted = predictor not in ('null', '1')
+        if predicted and not (predictor.isdigit() and int(predictor) >= 10 and
+                              self._decode_parm(pdf_doc, xref, "Colors", '1') == str(components) and
+                              self._decode_parm(pdf_doc, xref, "BitsPerComponent", '8') == '8' and
+                              self._decode_parm(pdf_doc, xref, "Columns", '1') == str(width)):
+            return None  # TIFF predictor or rows laid out unlike the image
+        
+        def strips():
+            row_bytes = width * components
+            stored_row_bytes = row_bytes + 1 if predicted else row_bytes  # PNG rows lead with a filter type
+            strip_bytes = stored_row_bytes * STRIP_ROWS
+            raw = pdf_doc.xref_stream_raw(xref)
+            decompressor = zlib.decompressobj()
+            pending = bytearray()
+            previous_row = bytes(stored_row_bytes)
+            
+            def convert(data, rows):
+                nonlocal previous_row
+                if predicted:
+                    # PIL's PNG decoder undoes the row filters; the previous
+                    # strip's last row goes first, unfiltered, as the row the
+                    # first one refers to
+                    decoded = Image.frombytes(raw_mode, (width, rows + 1),
+                                              zlib.compress(previous_row + data, 0), 'zip', raw_mode).tobytes()
+                    previous_row = b'\x00' + decoded[-row_bytes:]
+                    data = decoded[row_bytes:]
+                if components == 4:
+                    part = fitz.Pixmap(fitz.csCMYK, width, rows, bytes(data), False)
+                    return fitz.Pixmap(fitz.csRGB, part).samples
+                return bytes(data)
+            
+            for pos in range(0, len(raw), 1 << 16):
+                data = raw[pos:pos + (1 << 16)]
+                while data:
+                    pending += decompressor.decompress(data, strip_bytes)
+                    data = decompressor.unconsumed_tail
+                    while len(pending) >= strip_bytes:
+                        yield convert(pending[:strip_bytes], STRIP_ROWS)
+                        del pending[:strip_bytes]
+            
+            pending += decompressor.flush()
+            rows = len(pending) // stored_row_bytes
+            if rows:
+                yield convert(pending[:rows * stored_row_bytes], rows)
+        
+        return width, height, self._strip_mode(colorspace.lstrip('/'), False), strips()
+    
+    def _decode_parm(self, pdf_doc, xref: int, key: str, default: str) -> str:
+        """A /DecodeParms entry of a stream, or its default"""
+        value_type, value = pdf_doc.xref_get_key(xref, f"DecodeParms/{key}")
+        return default if value_type == 'null' else value
+    
+    def _open_jpeg_strips(self, pdf_doc, xref: int, new_size: Tuple[int, int]):
+        """Decode a gray, RGB or CMYK JPEG at reduced scale when it will be downsampled"""
+        import fitz
+        from PIL import Image
+        
+        if pdf_doc.xref_get_key(xref, "Filter")[1] != '/DCTDecode':
+            return None
+        
+        jpeg = Image.open(io.BytesIO(pdf_doc.xref_stream_raw(xref)))
+        colorspace = pdf_doc.xref_get_key(xref, "ColorSpace")[1]
+        decode = pdf_doc.xref_get_key(xref, "Decode")
+        if (jpeg.mode, colorspace) not in (('L', '/DeviceGray'), ('RGB', '/DeviceRGB'), ('CMYK', '/DeviceCMYK')):
+            return None  # Other color spaces go through PyMuPDF's conversion
+        
+        invert = False
+        if jpeg.mode == 'CMYK':
+            # PIL always undoes Adobe's inverted CMYK, but in a PDF the stored
+            # samples are used as they are unless /Decode flips them (as
+            # MuPDF does), so PIL's output is inverted back without one
+            if decode[0] == 'null':
+                invert = True
+            elif decode[1].strip('[]').split() != ['1', '0'] * 4:
+                return None
+        elif decode[0] != 'null':
+            return None
+        
+        # Let libjpeg scale by 1/2, 1/4 or 1/8 while decoding; a JPEG it
+        # cannot scale down would be decoded at full size
+        full_size = jpeg.size
+        jpeg.draft(jpeg.mode, new_size)
+        if jpeg.size == full_size:
+            return None
+        jpeg.load()
+        
+        def strips():
+            for y in range(0, jpeg.height, STRIP_ROWS):
+                rows = min(STRIP_ROWS, jpeg.height - y)
+                data = jpeg.crop((0, y, jpeg.width, y + rows)).tobytes()
+                if jpeg.mode != 'CMYK':
+                    yield data
+                    continue
+                
+                if invert:
+                    data = data.translate(INVERT_BYTES)
+                part = fitz.Pixmap(fitz.csCMYK, jpeg.width, rows, data, False)
+                yield fitz.Pixmap(fitz.csRGB, part).samples
+        
+        return jpeg.width, jpeg.height, 'RGB' if jpeg.mode == 'CMYK' else jpeg.mode, strips()
+    
+    def _resample_in_strips(self, strips: Iterator[bytes], width: int, height: int,
+                            mode: str, new_size: Tuple[int, int]):
+        """Resample row strips into an image of new_size, keeping only the rows the filter needs"""
+        from PIL import Image
+        
+        new_width, new_height = new_size
+        scale_y = height / new_height
+        margin = int(3 * scale_y) + 2  # Lanczos support in source rows
+        row_bytes = width * len(mode)
+        output = Image.new(mode, new_size)
+        
+        buffer = bytearray()
+        buffer_y0 = 0
+        out_y = 0
+        
+        def emit(available_rows):
+            nonlocal buffer, buffer_y0, out_y
+            while out_y < new_height:
+                out_end = min(new_height, out_y + STRIP_ROWS)
+                need = min(height, int(out_end * scale_y) + margin)
+                if available_rows < need:
+                    return
+                
+                top = max(0, int(out_y * scale_y) - margin)
+                start = (top - buffer_y0) * row_bytes
+                with memoryview(buffer) as view:
+                    window = Image.frombytes(mode, (width, need - top),
+                                             view[start:start + (need - top) * row_bytes])
+                box = (0, out_y * scale_y - top, width, out_end * scale_y - top)
+                output.paste(window.resize((new_width, out_end - out_y), Image.Resampling.LANCZOS, box=box),
+                             (0, out_y))
+                out_y = out_end
+                
+                # Drop rows the next output strip no longer needs
+                keep_from = max(0, int(out_y * scale_y) - margin)
+                if keep_from > buffer_y0:
+                    del buffer[:(keep_from - buffer_y0) * row_bytes]
+                    buffer_y0 = keep_from
+        
+        for strip in strips:
+            buffer += strip
+            emit(buffer_y0 + len(buffer) // row_bytes)
+        
+        if out_y < new_height:
+            raise ValueError("Image data ended early")
+        return output
+    
+    def _encode_jpeg(self, img, quality: int) -> bytes:
+        """Encode a PIL image as JPEG"""
+        img_buffer = io.BytesIO()
+        img.save(img_buffer, format='JPEG', quality=quality, optimize=True)
+        return img_buffer.getvalue()
+    
+    def _encode_jpeg_for_ssim(self, img, target_ssim: float) -> bytes:
+        """Encode at the lowest JPEG quality whose SSIM meets the target"""
+        from PIL import Image
+        
+        reference = self._ssim_luminance(img)
+        low, high = SSIM_QUALITY_RANGE
+        best = None
+        
+        # Binary search; the top of the range is used if no probe passes
+        for _ in range(SSIM_MAX_PROBES):
+            if low > high:
+                break
+            quality = (low + high) // 2
+            data = self._encode_jpeg(img, quality)
+            candidate = self._ssim_luminance(Image.open(io.BytesIO(data)))
+            if self._ssim(reference, candidate) >= target_ssim:
+                best = data
+                high = quality - 1
+            else:
+                low = quality + 1
+        
+        return best if best is not None else self._encode_jpeg(img, SSIM_QUALITY_RANGE[1])
+    
+    def _ssim_luminance(self, img):
+        """Downscaled luminance plane as a float array"""
+        import numpy as np
+        from PIL import Image
+        
+        luminance = img.convert('L')
+        scale = SSIM_MAX_SIDE / max(luminance.size)
+        if scale < 1:
+            size = (max(1, round(luminance.width * scale)), max(1, round(luminance.height * scale)))
+            luminance = luminance.resize(size, Image.Resampling.BOX)
+        return np.asarray(luminance, dtype=np.float64)
+    
+    def _ssim(self, reference, candidate) -> float:
+        """Mean SSIM over all SSIM_WINDOW-square windows, computed with integral images"""
+        import numpy as np
+        
+        window = min(SSIM_WINDOW, *reference.shape)
+        area = window * window
+        
+        def window_mean(values):
+            integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+            integral[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+            return (integral[window:, window:] - integral[:-window, window:]
+                    - integral[window:, :-window] + integral[:-window, :-window]) / area
+        
+        mean_x = window_mean(reference)
+        mean_y = window_mean(candidate)
+        var_x = window_mean(reference * reference) - mean_x ** 2
+        var_y = window_mean(candidate * candidate) - mean_y ** 2
+        covariance = window_mean(reference * candidate) - mean_x * mean_y
+        
+        c1 = (0.01 * 255) ** 2
+        c2 = (0.03 * 255) ** 2
+        ssim_map = (((2 * mean_x * mean_y + c1) * (2 * covariance + c2)) /
+                    ((mean_x ** 2 + mean_y ** 2 + c1) * (var_x + var_y + c2)))
+        return float(ssim_map.mean())
+    
+    def _fallback_compression(self, source: PDFSource, target: PDFTarget, quality: int,
+                              target_ssim: Optional[float] = None) -> Tuple[bool, str]:
         """Fallback compression using PyMuPDF with text preservation"""
         try:
             import fitz  # PyMuPDF
-            from PIL import Image
-            import io
-            
+        except ImportError:
+            return self._alternative_compression(source, target, quality)
+        
+        try:
             # Open PDF with PyMuPDF
-            pdf_doc = fitz.open(input_path)
+            if isinstance(source, bytes):
+                pdf_doc = fitz.open(stream=source, filetype='pdf')
+            else:
+                pdf_doc = fitz.open(source)
             
             # Quality settings - balanced for compression and text preservation
-            image_quality = max(25, min(75, quality * 0.8))  # Lower quality for better compression
-            scale_factor = max(0.5, quality / 100.0)  # 50% to 100% of original size
+            image_quality = int(max(25, min(75, quality * 0.8)))  # Lower quality for better compression
+            scale_factor = max(0.5, quality / 100.0)  # Used when an image has no known placement
+            target_dpi = self._target_dpi_tier(quality)
+            effective_dpi = self._collect_effective_dpi(pdf_doc)
             
             images_processed = 0
             total_savings = 0
+            seen_xrefs = set()
             
             # Process each page
             for page_num in range(len(pdf_doc)):
@@ -204,88 +1048,139 @@ class WorkingPDFCompressor:
                 for img_index, img in enumerate(image_list):
                     try:
                         # Get image data
-                        xref = img[0]
-                        pix = fitz.Pixmap(pdf_doc, xref)
+                        xref, smask_xref = img[0], img[1]
+                        width, height = img[2], img[3]
+                        if xref in seen_xrefs:
+                            continue  # Shared image already handled on an earlier page
+                        seen_xrefs.add(xref)
                         
-                        # Skip if image is too small, has alpha channel, or is likely a text element
-                        if (pix.width < 150 or pix.height < 150 or 
-                            pix.alpha or pix.width > 3000 or pix.height > 3000):
-                            pix = None
+                        # Skip if image is too small or is likely a text element
+                        if width < 150 or height < 150:
                             continue
                         
-                        # Convert to PIL Image
-                        if pix.n == 1:  # Grayscale
-                            img_data = pix.tobytes("png")
-                            pil_img = Image.open(io.BytesIO(img_data)).convert('L')
-                        elif pix.n == 3:  # RGB
-                            img_data = pix.tobytes("png")
-                            pil_img = Image.open(io.BytesIO(img_data)).convert('RGB')
-                        else:
-                            pix = None
+                        # A /Matte soft mask must keep the size of its base image
+                        if smask_xref and pdf_doc.xref_get_key(smask_xref, "Matte")[0] != 'null':
                             continue
                         
-                        # Calculate new size - more conservative
-                        original_size = pil_img.size
-                        new_width = int(original_size[0] * scale_factor)
-                        new_height = int(original_size[1] * scale_factor)
+                        # Downsample to the target DPI for how large the image is drawn
+                        dpi = effective_dpi.get(xref)
+                        if dpi is None:
+                            image_scale = scale_factor
+                        elif dpi > target_dpi * DOWNSAMPLE_THRESHOLD:
+                            image_scale = target_dpi / dpi
+                        else:
+                            image_scale = 1.0
                         
-                        # Ensure reasonable minimum size
-                        new_width = max(200, new_width)
-                        new_height = max(200, new_height)
+                        new_size = (max(1, int(width * image_scale)), max(1, int(height * image_scale)))
+                        if not (new_size[0] < width * 0.9 or new_size[1] < height * 0.9):
+                            new_size = (width, height)
                         
-                        # Always resize for compression (but more conservative)
-                        if new_width < original_size[0] * 0.9 or new_height < original_size[1] * 0.9:
-                            # Resize image
-                            resized_img = pil_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                        else:
-                            resized_img = pil_img
+                        # Re-encoding a large image at its own size gains little
+                        # for two full-size buffers
+                        large = width > LARGE_IMAGE_SIDE or height > LARGE_IMAGE_SIDE
+                        if large and new_size == (width, height):
+                            continue
+                        
+                        # Decode, convert and resample strip by strip
+                        src_width, src_height, mode, strips = self._open_image_strips(
+                            pdf_doc, xref, new_size, large)
+                        resized_img = self._resample_in_strips(strips, src_width, src_height, mode, new_size)
+                        
+                        alpha_img = None
+                        if mode in ('LA', 'RGBA'):
+                            alpha_img = resized_img.getchannel('A')
+                            resized_img = resized_img.convert(mode[:-1])
                         
                         # Compress as JPEG with higher quality to preserve text readability
-                        img_buffer = io.BytesIO()
-                        resized_img.save(img_buffer, format='JPEG', quality=image_quality, optimize=True)
-                        compressed_data = img_buffer.getvalue()
+                        if target_ssim is None:
+                            compressed_data = self._encode_jpeg(resized_img, image_quality)
+                        else:
+                            compressed_data = self._encode_jpeg_for_ssim(resized_img, target_ssim)
                         
-                        # Calculate savings
-                        original_img_size = len(img_data)
+                        # Calculate savings against the streams stored in the PDF,
+                        # counting a soft mask that would be rebuilt from alpha
+                        original_img_size = len(pdf_doc.xref_stream_raw(xref))
                         compressed_img_size = len(compressed_data)
+                        if alpha_img is not None:
+                            if smask_xref:
+                                original_img_size += len(pdf_doc.xref_stream_raw(smask_xref))
+                            compressed_img_size += len(zlib.compress(alpha_img.tobytes()))
                         savings = original_img_size - compressed_img_size
                         
                         # Replace if we get any savings (more aggressive)
                         if savings > original_img_size * 0.05:  # At least 5% savings
                             # Replace image in PDF
-                            pdf_doc.update_stream(xref, compressed_data)
+                            self._replace_image_stream(pdf_doc, xref, compressed_data,
+                                                       resized_img.width, resized_img.height,
+                                                       resized_img.mode)
                             images_processed += 1
                             total_savings += savings
+                            
+                            # Recompress the transparency separately from the color data
+                            if alpha_img is not None:
+                                self._add_mask_stream(pdf_doc, xref, alpha_img)
+                            elif smask_xref and new_size != (width, height):
+                                mask_width, mask_height, mask_mode, mask_strips = self._open_image_strips(
+                                    pdf_doc, smask_xref, new_size, large)
+                                mask_img = self._resample_in_strips(
+                                    mask_strips, mask_width, mask_height, mask_mode, new_size)
+                                self._replace_mask_stream(pdf_doc, smask_xref, mask_img.convert('L'))
                         
-                        pix = None  # Free memory
                         
                     except Exception as img_error:
                         continue
             
-            # Save the modified PDF
-            pdf_doc.save(output_path)
+            total_savings += self._deflate_streams(pdf_doc)
+            
+            # Nothing got smaller, so the original is already the best result
+            if total_savings <= 0:
+                pdf_doc.close()
+                self._keep_original(source, target)
+                return True, NOT_REDUCED_MESSAGE
+            
+            # Save the modified PDF; garbage collection drops replaced soft masks
+            pdf_doc.save(target if isinstance(target, str) else self._open_target(target), garbage=1)
             pdf_doc.close()
             
             # Calculate compression ratio
-            original_size = os.path.getsize(input_path)
-            compressed_size = os.path.getsize(output_path)
+            original_size = self._source_size(source)
+            compressed_size = self._target_size(target)
             
             if compressed_size < original_size:
                 compression_ratio = (1 - compressed_size / original_size) * 100
                 return True, f"Successfully compressed! Size reduced by {compression_ratio:.1f}% (Processed {images_processed} images, text preserved)"
-            else:
-                # Try alternative compression method
-                return self._alternative_compression(input_path, output_path, quality)
+            
+            # Rewriting the file structure cost more than the streams saved
+            self._keep_original(source, target)
+            return True, NOT_REDUCED_MESSAGE
         
         except Exception as e:
             return False, f"Error compressing PDF: {str(e)}"
     
-    def _alternative_compression(self, input_path: str, output_path: str, quality: int) -> Tuple[bool, str]:
-        """Alternative compression method using basic PyPDF2"""
+    def _deflate_streams(self, pdf_doc) -> int:
+        """Flate-compress unfiltered streams that get smaller; returns the bytes saved"""
+        # Covers what PyPDF2's content stream compression used to add
+        saved = 0
+        for xref in range(1, pdf_doc.xref_length()):
+            try:
+                if not pdf_doc.xref_is_stream(xref) or pdf_doc.xref_get_key(xref, "Filter")[0] != 'null':
+                    continue
+                raw = pdf_doc.xref_stream_raw(xref)
+                compressed = zlib.compress(raw)
+                if len(compressed) < len(raw):
+                    pdf_doc.update_stream(xref, compressed, compress=False)
+                    pdf_doc.xref_set_key(xref, "Filter", "/FlateDecode")
+                    saved += len(raw) - len(compressed)
+            except Exception:
+                continue  # Free or broken entry
+        return saved
+    
+    def _alternative_compression(self, source: PDFSource, target: PDFTarget, quality: int) -> Tuple[bool, str]:
+        """Compression with basic PyPDF2, used when PyMuPDF is not installed"""
         try:
             from PyPDF2 import PdfReader, PdfWriter
             
-            reader = PdfReader(input_path)
+            reader = PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
             writer = PdfWriter()
             
             # Add all pages with compression
@@ -299,21 +1194,23 @@ class WorkingPDFCompressor:
                 writer.add_metadata(reader.metadata)
             
             # Write with compression
-            with open(output_path, 'wb') as output_file:
+            output_file = self._open_target(target)
+            try:
                 writer.write(output_file)
+            finally:
+                if isinstance(target, str):
+                    output_file.close()
             
             # Calculate compression ratio
-            original_size = os.path.getsize(input_path)
-            compressed_size = os.path.getsize(output_path)
+            original_size = self._source_size(source)
+            compressed_size = self._target_size(target)
             
             if compressed_size < original_size:
                 compression_ratio = (1 - compressed_size / original_size) * 100
                 return True, f"Successfully compressed! Size reduced by {compression_ratio:.1f}% (Content stream compression)"
-            else:
-                # Even if no compression, copy file as success
-                import shutil
-                shutil.copy2(input_path, output_path)
-                return True, f"File processed. No significant compression achieved. Consider using Ghostscript for better results."
+            
+            self._keep_original(source, target)
+            return True, NOT_REDUCED_MESSAGE
         
         except Exception as e:
             return False, f"Error in alternative compression: {str(e)}"
@@ -332,13 +1229,4 @@ class WorkingPDFCompressor:
     
     def format_file_size(self, size_bytes: int) -> str:
         """Format file size in human readable format"""
-        if size_bytes == 0:
-            return "0 B"
-        
-        size_names = ["B", "KB", "MB", "GB"]
-        i = 0
-        while size_bytes >= 1024 and i < len(size_names) - 1:
-            size_bytes /= 1024.0
-            i += 1
-        
-        return f"{size_bytes:.1f} {size_names[i]}"
+        return format_file_size(size_bytes)